@@ -0,0 +1,111 @@
+"""Benchmark TelegramBot.check_requests with many registered chats and accept options.
+
+The Telegram Bot API is replaced by a stand-in that answers immediately, so the benchmark measures
+the time the bot itself needs to build and send the request messages. Run it from the root folder
+of the repository:
+
+    python -m benchmarks.check_requests [--requests 50] [--chats 20] [--options 8] [--rounds 5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+from types import SimpleNamespace
+
+from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
+from unifi_hotspot_telegram.telegram_bot import TelegramBot
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        """Initialize the FakeBot class, a stand-in for telegram.Bot that doesn't send anything."""
+        self.message_id = 0
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        """Pretend to send a message.
+
+        Returns:
+            SimpleNamespace: An object with a new message_id, like telegram.Message.
+        """
+        self.message_id += 1
+        return SimpleNamespace(message_id=self.message_id)
+
+
+async def run_rounds(
+    bot: TelegramBot, db_connector: SQLiteConnector, requests: int, rounds: int
+) -> list:
+    """Add open requests and let the bot send them, several times.
+
+    Args:
+        bot (TelegramBot): The bot to benchmark.
+        db_connector (SQLiteConnector): The connector to the bot's database.
+        requests (int): The number of open requests per round.
+        rounds (int): The number of rounds.
+
+    Returns:
+        list: The duration of each round (in seconds).
+    """
+    context = SimpleNamespace(bot=FakeBot())
+    durations = []
+
+    for _ in range(rounds):
+        for _ in range(requests):
+            db_connector.add_request(uuid.uuid4().hex, "Guest", "aa:bb:cc:dd:ee:ff")
+
+        start = time.perf_counter()
+        await bot.check_requests(context)
+        durations.append(time.perf_counter() - start)
+
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--requests", type=int, default=50, help="open requests per round"
+    )
+    parser.add_argument("--chats", type=int, default=20, help="registered chats")
+    parser.add_argument(
+        "--options", type=int, default=8, help="accept options per request"
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="number of rounds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_connector = SQLiteConnector(os.path.join(directory, "data.db"))
+        for chat_id in range(args.chats):
+            db_connector.add_chat(str(chat_id))
+
+        bot = TelegramBot(
+            "password",
+            "123456:benchmark",
+            "username",
+            "password",
+            bot_accept_options=[
+                60 * (option + 1) + option for option in range(args.options)
+            ],
+            portal_notification_socket=os.path.join(directory, "guest_portal.sock"),
+            db_connector=db_connector,
+            # The stand-in has no rate limits, so the bot's pacing would only measure Telegram's limits
+            messages_per_second=0,
+            chat_messages_per_minute=0,
+        )
+
+        durations = asyncio.run(
+            run_rounds(bot, db_connector, args.requests, args.rounds)
+        )
+
+    messages = args.requests * args.chats
+    best = min(durations)
+    print(
+        f"{args.requests} requests x {args.chats} chats x {args.options} options, {args.rounds} rounds"
+    )
+    print(f"  best round:  {best * 1000:.1f} ms ({messages / best:.0f} messages/s)")
+    print(f"  mean round:  {sum(durations) / len(durations) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
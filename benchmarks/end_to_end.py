@@ -0,0 +1,513 @@
+"""Load test the guest portal and the telegram bot end to end with local stand-ins for Telegram and UniFi.
+
+The guest portal is served by waitress on a local port and the telegram bot talks to a fake Telegram Bot API
+server over HTTP, both with a temporary database. Simulated guests submit the form and wait for the result
+(polling check_update, or long polling wait_update with --long-poll) while simulated admins click the first
+accept button of every request they receive. The UniFi controller is replaced by a stand-in with a fixed
+latency. The benchmark reports the throughput and the latency from submitting the form until the guest is
+authorized and until the guest sees the result. Run it from the root folder of the repository:
+
+    python -m benchmarks.end_to_end [--guests 200] [--concurrency 20] [--admins 3] [--long-poll]
+"""
+import argparse
+import json
+import os
+import queue
+import re
+import signal
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from waitress import create_server
+
+from unifi_hotspot_telegram.guest_portal import GuestPortal
+from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
+from unifi_hotspot_telegram.telegram_bot import TelegramBot
+
+# The token of the simulated bot (the fake Bot API server accepts any token)
+TELEGRAM_TOKEN = "123456:benchmark"
+
+# The longest time (in seconds) the fake Bot API server holds a getUpdates request open
+MAX_GET_UPDATES_TIMEOUT = 1
+
+
+class FakeTelegramAPI:
+    def __init__(self) -> None:
+        """Initialize the FakeTelegramAPI class, a stand-in for the methods of the Telegram Bot API the bot uses."""
+        self.lock = threading.Condition()
+        self.updates = []  # list: The updates that were not fetched with getUpdates yet
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.chats = (
+            {}
+        )  # dict: Maps a chat ID to the queue of messages the admin of the chat has to answer
+        self.polling = threading.Event()  # Set once the bot fetches updates
+        self.edited_messages = 0
+        self.answered_queries = 0
+
+    def add_chat(self, chat_id: int) -> queue.Queue:
+        """Add the chat of an admin.
+
+        Args:
+            chat_id (int): The ID of the chat.
+
+        Returns:
+            queue.Queue: The queue receiving the messages with a keyboard sent to the chat.
+        """
+        self.chats[chat_id] = queue.Queue()
+        return self.chats[chat_id]
+
+    def call(self, method: str, parameters: dict):
+        """Handle a call of the Bot API.
+
+        Args:
+            method (str): The name of the method (e.g. 'sendMessage').
+            parameters (dict): The parameters of the call.
+
+        Returns:
+            The result of the call.
+        """
+        if method == "getMe":
+            return {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Benchmark",
+                "username": "benchmark_bot",
+            }
+        if method == "getUpdates":
+            return self.get_updates(
+                int(parameters.get("offset", 0)), float(parameters.get("timeout", 0))
+            )
+        if method == "sendMessage":
+            return self.send_message(
+                int(parameters["chat_id"]),
+                parameters["text"],
+                json.loads(parameters.get("reply_markup", "null")),
+            )
+        if method == "editMessageText":
+            with self.lock:
+                self.edited_messages += 1
+            return True
+        if method == "answerCallbackQuery":
+            with self.lock:
+                self.answered_queries += 1
+            return True
+
+        # Everything else (e.g. deleteWebhook) just succeeds
+        return True
+
+    def get_updates(self, offset: int, timeout: float) -> list:
+        """Return the updates from an update ID on, waiting for new ones up to a timeout.
+
+        Args:
+            offset (int): The first update ID to return (all older updates are confirmed).
+            timeout (float): The time (in seconds) to wait if there are no updates.
+
+        Returns:
+            list: The updates.
+        """
+        self.polling.set()
+        deadline = time.monotonic() + min(timeout, MAX_GET_UPDATES_TIMEOUT)
+
+        with self.lock:
+            self.updates = [
+                update for update in self.updates if update["update_id"] >= offset
+            ]
+            while not self.updates and time.monotonic() < deadline:
+                self.lock.wait(deadline - time.monotonic())
+            return list(self.updates)
+
+    def send_message(self, chat_id: int, text: str, reply_markup: dict) -> dict:
+        """Pretend to send a message and pass it on to the admin of the chat.
+
+        Args:
+            chat_id (int): The ID of the chat.
+            text (str): The text of the message.
+            reply_markup (dict): The inline keyboard of the message, or None.
+
+        Returns:
+            dict: The sent message.
+        """
+        with self.lock:
+            message = {
+                "message_id": self.next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+            self.next_message_id += 1
+
+        if reply_markup is not None:
+            self.chats[chat_id].put((message, reply_markup))
+        return message
+
+    def click(self, admin_id: int, message: dict, callback_data: str) -> None:
+        """Add the update of an admin clicking a button.
+
+        Args:
+            admin_id (int): The ID of the admin (and the admin's chat).
+            message (dict): The message with the button.
+            callback_data (str): The callback data of the button.
+        """
+        with self.lock:
+            self.updates.append(
+                {
+                    "update_id": self.next_update_id,
+                    "callback_query": {
+                        "id": str(self.next_update_id),
+                        "from": {
+                            "id": admin_id,
+                            "is_bot": False,
+                            "first_name": "Admin",
+                            "last_name": str(admin_id),
+                            "username": f"admin{admin_id}",
+                        },
+                        "chat_instance": str(admin_id),
+                        "message": message,
+                        "data": callback_data,
+                    },
+                }
+            )
+            self.next_update_id += 1
+            self.lock.notify_all()
+
+
+def create_telegram_server(api: FakeTelegramAPI) -> ThreadingHTTPServer:
+    """Create an HTTP server answering Bot API calls (POST /bot<token>/<method>) with a FakeTelegramAPI.
+
+    Args:
+        api (FakeTelegramAPI): The API to answer the calls with.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server listening on a free local port.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep the connections of the bot open
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                parameters = json.loads(body or b"{}")
+            else:
+                parameters = {
+                    name: values[0]
+                    for name, values in urllib.parse.parse_qs(body.decode()).items()
+                }
+
+            method = self.path.rsplit("/", 1)[-1]
+            response = json.dumps(
+                {"ok": True, "result": api.call(method, parameters)}
+            ).encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            # Don't log every call
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+
+class FakeController:
+    def __init__(self, latency: float) -> None:
+        """Initialize the FakeController class, a stand-in for pyunifi's Controller.
+
+        Args:
+            latency (float): The time (in seconds) each call takes.
+        """
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.authorizations = (
+            {}
+        )  # dict: Maps a MAC address to the times it was authorized
+
+    def authorize_guest(self, mac: str, minutes: int) -> None:
+        """Pretend to authorize a guest and remember when.
+
+        Args:
+            mac (str): The MAC address of the guest.
+            minutes (int): The duration of the authorization (in minutes).
+        """
+        time.sleep(self.latency)
+        with self.lock:
+            self.authorizations.setdefault(mac, []).append(time.perf_counter())
+
+
+def run_admin(
+    api: FakeTelegramAPI,
+    admin_id: int,
+    messages: queue.Queue,
+    delay: float,
+    stop: threading.Event,
+) -> None:
+    """Click the first accept button of every request an admin receives (after the delay the admin needs to decide).
+
+    Args:
+        api (FakeTelegramAPI): The fake Bot API.
+        admin_id (int): The ID of the admin (and the admin's chat).
+        messages (queue.Queue): The queue of received messages with their keyboards.
+        delay (float): The time (in seconds) the admin needs to decide.
+        stop (threading.Event): Set once the benchmark is over.
+    """
+    while not stop.is_set():
+        try:
+            message, reply_markup = messages.get(timeout=0.2)
+        except queue.Empty:
+            continue
+
+        # The admin looks at every request in parallel, so the admins don't become the bottleneck
+        threading.Timer(
+            delay,
+            api.click,
+            args=(
+                admin_id,
+                message,
+                reply_markup["inline_keyboard"][0][0]["callback_data"],
+            ),
+        ).start()
+
+
+def run_guest(
+    portal_url: str, number: int, long_poll: bool, poll_interval: float
+) -> tuple:
+    """Submit the form as a guest and wait for the result.
+
+    Args:
+        portal_url (str): The URL of the guest portal.
+        number (int): The number of the guest (used for its MAC address).
+        long_poll (bool): Whether to wait with wait_update instead of polling check_update.
+        poll_interval (float): The time (in seconds) between two check_update requests.
+
+    Returns:
+        tuple: The MAC address of the guest, the time the form was submitted and the time the guest saw the result
+            (None if there was no result within a minute).
+    """
+    mac = (
+        f"02:00:00:{number >> 16 & 255:02x}:{number >> 8 & 255:02x}:{number & 255:02x}"
+    )
+    submitted = time.perf_counter()
+
+    form = urllib.parse.urlencode({"name": f"Guest {number}"}).encode()
+    with urllib.request.urlopen(
+        f"{portal_url}/guest/s/default/?id={mac}", data=form
+    ) as response:
+        page = response.read().decode()
+    unique_id = re.search(r"wait_update/(\w+)", page).group(1)
+
+    deadline = submitted + 60
+    while time.perf_counter() < deadline:
+        route = "wait_update" if long_poll else "check_update"
+        try:
+            with urllib.request.urlopen(
+                f"{portal_url}/guest/s/default/{route}/{unique_id}"
+            ) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if not long_poll or e.code != 503:
+                raise
+            # All long poll threads are busy, so fall back to check_update like the waiting page does
+            long_poll = False
+            result = {}
+        if "duration" in result:
+            return mac, submitted, time.perf_counter()
+        if not long_poll:
+            time.sleep(poll_interval)
+
+    return mac, submitted, None
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Get a percentile of a list of values (the nearest value below).
+
+    Args:
+        values (list): The values.
+        fraction (float): The percentile as fraction (e.g. 0.99).
+
+    Returns:
+        float: The percentile.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def format_latencies(latencies: list) -> str:
+    """Format the p50 and p99 of latencies.
+
+    Args:
+        latencies (list): The latencies (in seconds).
+
+    Returns:
+        str: The formatted percentiles.
+    """
+    if len(latencies) == 0:
+        return "no results"
+    return f"p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guests", type=int, default=200, help="number of guests")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=20,
+        help="number of guests submitting/waiting at the same time",
+    )
+    parser.add_argument("--admins", type=int, default=3, help="number of admins")
+    parser.add_argument(
+        "--admin-delay",
+        type=float,
+        default=0.1,
+        help="time (in seconds) an admin needs to click a button",
+    )
+    parser.add_argument(
+        "--unifi-latency",
+        type=float,
+        default=0.05,
+        help="time (in seconds) the UniFi controller needs to authorize a guest",
+    )
+    parser.add_argument(
+        "--long-poll",
+        action="store_true",
+        help="wait with wait_update instead of polling check_update",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="time (in seconds) between two check_update requests of a guest",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "data.db")
+    bot_socket = os.path.join(directory, "telegram_bot.sock")
+    portal_socket = os.path.join(directory, "guest_portal.sock")
+
+    # The admins' chats are registered already
+    api = FakeTelegramAPI()
+    db_connector = SQLiteConnector(database)
+    admin_queues = {}
+    for admin_id in range(1, args.admins + 1):
+        db_connector.add_chat(str(admin_id))
+        admin_queues[admin_id] = api.add_chat(admin_id)
+
+    telegram_server = create_telegram_server(api)
+    threading.Thread(target=telegram_server.serve_forever, daemon=True).start()
+
+    # All guests come from the same IP address, so only the limit per MAC address applies
+    guest_portal = GuestPortal(
+        bot_notification_socket=bot_socket,
+        notification_socket=portal_socket,
+        db_connector=SQLiteConnector(database),
+        threads=args.concurrency + 4,
+        long_poll_threads=args.concurrency,
+        ip_rate_limit=0,
+        metrics_port=0,
+    )
+    guest_portal.start_notification_listener()
+    portal_server = create_server(
+        guest_portal.app,
+        host="127.0.0.1",
+        port=0,
+        threads=args.concurrency + 4,
+    )
+    threading.Thread(target=portal_server.run, daemon=True).start()
+    portal_url = f"http://127.0.0.1:{portal_server.effective_port}"
+
+    bot = TelegramBot(
+        "benchmark",
+        TELEGRAM_TOKEN,
+        "admin",
+        "password",
+        notification_socket=bot_socket,
+        portal_notification_socket=portal_socket,
+        db_connector=SQLiteConnector(database),
+        retention_days=0,
+        metrics_push_interval=0,
+        # The stand-in has no rate limits, so the bot's pacing would only measure Telegram's limits
+        messages_per_second=0,
+        chat_messages_per_minute=0,
+        telegram_base_url=f"http://127.0.0.1:{telegram_server.server_port}/bot",
+    )
+    controller = FakeController(args.unifi_latency)
+    bot.unifi_session.get_controller = lambda: controller
+
+    results = {}
+
+    def drive() -> None:
+        """Run the admins and guests once the bot is polling and stop the bot afterwards."""
+        stop = threading.Event()
+        try:
+            api.polling.wait()
+            for admin_id, messages in admin_queues.items():
+                threading.Thread(
+                    target=run_admin,
+                    args=(api, admin_id, messages, args.admin_delay, stop),
+                    daemon=True,
+                ).start()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results["guests"] = list(
+                    executor.map(
+                        lambda number: run_guest(
+                            portal_url, number, args.long_poll, args.poll_interval
+                        ),
+                        range(args.guests),
+                    )
+                )
+            results["duration"] = time.perf_counter() - start
+        finally:
+            stop.set()
+            # Stop the bot like Ctrl-C does
+            os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=drive, daemon=True).start()
+
+    # The bot has to run in the main thread (it handles the signals to stop)
+    bot.run()
+    portal_server.close()
+    telegram_server.shutdown()
+
+    guests = results.get("guests", [])
+    completed = [guest for guest in guests if guest[2] is not None]
+    authorize_latencies = [
+        controller.authorizations[mac][0] - submitted
+        for mac, submitted, _ in guests
+        if mac in controller.authorizations
+    ]
+    result_latencies = [seen - submitted for _, submitted, seen in completed]
+    authorizations = sum(len(times) for times in controller.authorizations.values())
+
+    print(
+        f"{args.guests} guests ({args.concurrency} at a time, {'wait_update' if args.long_poll else 'check_update'}), "
+        f"{args.admins} admins, UniFi latency {args.unifi_latency * 1000:.0f} ms"
+    )
+    print(
+        f"  completed: {len(completed)}/{args.guests} in {results.get('duration', 0):.1f} s "
+        f"({len(completed) / max(results.get('duration', 0), 1e-9):.1f} guests/s)"
+    )
+    print(f"  submit -> authorize_guest:    {format_latencies(authorize_latencies)}")
+    print(f"  submit -> guest sees result:  {format_latencies(result_latencies)}")
+    print(
+        f"  authorize_guest calls: {authorizations}, messages edited: {api.edited_messages}, "
+        f"callback queries answered: {api.answered_queries}"
+    )
+
+
+if __name__ == "__main__":
+    main()
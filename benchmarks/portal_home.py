@@ -0,0 +1,65 @@
+"""Benchmark the home route of the guest portal (the form every guest loads first).
+
+The requests are sent through Flask's test client, so the numbers show the time spent in the portal
+itself (without network and server overhead), once with and once without the page cache. Run it from
+the root folder of the repository:
+
+    python -m benchmarks.portal_home [--requests 2000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from unifi_hotspot_telegram.guest_portal import GuestPortal
+from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
+
+
+def measure(guest_portal: GuestPortal, requests: int) -> float:
+    """Request the form with changing guest parameters and locales.
+
+    Args:
+        guest_portal (GuestPortal): The guest portal to benchmark.
+        requests (int): The number of requests.
+
+    Returns:
+        float: The number of requests per second.
+    """
+    client = guest_portal.app.test_client()
+    locales = guest_portal.supported_locales
+
+    start = time.perf_counter()
+    for number in range(requests):
+        response = client.get(
+            f"/guest/s/default/?id=aa:bb:cc:dd:{number % 256:02x}:ff"
+            f"&lang={locales[number % len(locales)]}&url=https://example.com/{number}"
+        )
+        assert response.status_code == 200
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=2000,
+        help="number of requests per configuration",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_connector = SQLiteConnector(os.path.join(directory, "data.db"))
+
+        for name, page_cache in [
+            ("without page cache (before)", False),
+            ("with page cache (after)", True),
+        ]:
+            guest_portal = GuestPortal(db_connector=db_connector, page_cache=page_cache)
+            # Warm up (Jinja compiles the template on first use)
+            measure(guest_portal, 10)
+            print(f"{name}: {measure(guest_portal, args.requests):.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Benchmark concurrent access to the database by the guest portal and the telegram bot.
+
+Writer processes add requests (like the guest portal on form submits) while reader processes look up
+confirmations (like waiting guests), once with SQLite's default settings and once with the settings
+used by SQLiteConnector. Run it from the root folder of the repository:
+
+    python -m benchmarks.sqlite_concurrency [--writers 2] [--readers 4] [--duration 5]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from multiprocessing import Process, Queue
+
+from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
+
+# The connector settings to compare (name, journal_mode, synchronous)
+CONFIGURATIONS = [
+    ("rollback journal (before)", "DELETE", "FULL"),
+    ("WAL (after)", "WAL", "NORMAL"),
+]
+
+
+def run_writer(
+    database: str, journal_mode: str, synchronous: str, deadline: float, results: Queue
+):
+    """Add requests until the deadline is reached.
+
+    Args:
+        database (str): The path of the database file.
+        journal_mode (str): The journal mode to use.
+        synchronous (str): The synchronous setting to use.
+        deadline (float): The time (as returned by time.time) to stop at.
+        results (multiprocessing.Queue): The queue to put the number of operations and errors into.
+    """
+    db_connector = SQLiteConnector(
+        database, journal_mode=journal_mode, synchronous=synchronous
+    )
+    operations = errors = 0
+
+    while time.time() < deadline:
+        try:
+            db_connector.add_request(uuid.uuid4().hex, "Guest", "aa:bb:cc:dd:ee:ff")
+            operations += 1
+        except sqlite3.OperationalError:
+            errors += 1
+
+    results.put(("add_request", operations, errors))
+
+
+def run_reader(
+    database: str, journal_mode: str, synchronous: str, deadline: float, results: Queue
+):
+    """Look up confirmations until the deadline is reached.
+
+    Args:
+        database (str): The path of the database file.
+        journal_mode (str): The journal mode to use.
+        synchronous (str): The synchronous setting to use.
+        deadline (float): The time (as returned by time.time) to stop at.
+        results (multiprocessing.Queue): The queue to put the number of operations and errors into.
+    """
+    db_connector = SQLiteConnector(
+        database, journal_mode=journal_mode, synchronous=synchronous
+    )
+    operations = errors = 0
+
+    while time.time() < deadline:
+        try:
+            db_connector.get_confirmation(uuid.uuid4().hex)
+            operations += 1
+        except sqlite3.OperationalError:
+            errors += 1
+
+    results.put(("get_confirmation", operations, errors))
+
+
+def run_configuration(
+    journal_mode: str, synchronous: str, writers: int, readers: int, duration: float
+) -> dict:
+    """Run the benchmark for one configuration in a fresh database.
+
+    Args:
+        journal_mode (str): The journal mode to use.
+        synchronous (str): The synchronous setting to use.
+        writers (int): The number of writer processes.
+        readers (int): The number of reader processes.
+        duration (float): The duration of the benchmark (in seconds).
+
+    Returns:
+        dict: The total number of operations and errors per operation.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "data.db")
+
+        # Create the tables before the clock starts
+        SQLiteConnector(database, journal_mode=journal_mode, synchronous=synchronous)
+
+        results = Queue()
+        deadline = time.time() + duration
+        processes = [
+            Process(
+                target=run_writer,
+                args=(database, journal_mode, synchronous, deadline, results),
+            )
+            for _ in range(writers)
+        ] + [
+            Process(
+                target=run_reader,
+                args=(database, journal_mode, synchronous, deadline, results),
+            )
+            for _ in range(readers)
+        ]
+
+        for process in processes:
+            process.start()
+
+        totals = {}
+        for _ in processes:
+            operation, operations, errors = results.get()
+            total = totals.setdefault(operation, {"operations": 0, "errors": 0})
+            total["operations"] += operations
+            total["errors"] += errors
+
+        for process in processes:
+            process.join()
+
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--writers", type=int, default=2, help="number of processes adding requests"
+    )
+    parser.add_argument(
+        "--readers",
+        type=int,
+        default=4,
+        help="number of processes reading confirmations",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5,
+        help="duration per configuration in seconds",
+    )
+    args = parser.parse_args()
+
+    for name, journal_mode, synchronous in CONFIGURATIONS:
+        totals = run_configuration(
+            journal_mode, synchronous, args.writers, args.readers, args.duration
+        )
+
+        print(f"{name}: journal_mode={journal_mode}, synchronous={synchronous}")
+        for operation, total in sorted(totals.items()):
+            print(
+                f"  {operation:<17} {total['operations'] / args.duration:>10.0f} ops/s"
+                f"  ({total['errors']} lock errors)"
+            )
+
+
+if __name__ == "__main__":
+    main()
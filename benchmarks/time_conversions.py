@@ -0,0 +1,69 @@
+"""Benchmark convert_minutes_into_human_readable_string with durations like the ones of bot_accept_options.
+
+The durations (every hour up to a week, every day up to a year and a few odd values) are converted for all
+locales, once without the cache (calling the wrapped function) and once with it. Run it from the root folder
+of the repository:
+
+    python -m benchmarks.time_conversions [--rounds 20]
+"""
+import argparse
+import time
+
+from unifi_hotspot_telegram.i18n_manager import I18nManager
+from unifi_hotspot_telegram.time_conversions import (
+    convert_minutes_into_human_readable_string,
+)
+
+
+def measure(convert, durations: list, i18n_managers: list, rounds: int) -> float:
+    """Convert all durations for all locales several times.
+
+    Args:
+        convert: The conversion function to benchmark.
+        durations (list): The durations (in minutes) to convert.
+        i18n_managers (list): An I18nManager per locale.
+        rounds (int): The number of times all durations are converted.
+
+    Returns:
+        float: The number of conversions per second.
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for i18n_manager in i18n_managers:
+            for duration in durations:
+                convert(duration, i18n_manager)
+    conversions = rounds * len(i18n_managers) * len(durations)
+    return conversions / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=20,
+        help="number of times all durations are converted",
+    )
+    args = parser.parse_args()
+
+    durations = (
+        list(range(60, 60 * 24 * 7 + 1, 60))
+        + list(range(60 * 24, 60 * 24 * 365 + 1, 60 * 24))
+        + [1, 45, 90, 1441, 4321, 10081, 60 * 24 * 400 + 61]
+    )
+    i18n_manager = I18nManager()
+    i18n_managers = [i18n_manager.for_locale(locale) for locale in i18n_manager.catalog]
+    print(
+        f"{len(durations)} durations x {len(i18n_managers)} locales, {args.rounds} rounds"
+    )
+
+    for name, convert in [
+        ("without cache", convert_minutes_into_human_readable_string.__wrapped__),
+        ("with cache", convert_minutes_into_human_readable_string),
+    ]:
+        rate = measure(convert, durations, i18n_managers, args.rounds)
+        print(f"  {name}: {rate:.0f} conversions/s")
+
+
+if __name__ == "__main__":
+    main()
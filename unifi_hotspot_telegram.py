@@ -3,6 +3,8 @@ import json
 from multiprocessing import Process
 
 from unifi_hotspot_telegram.guest_portal import GuestPortal
+from unifi_hotspot_telegram.profiling import PROFILER
+from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
 from unifi_hotspot_telegram.telegram_bot import TelegramBot
 
 
@@ -37,12 +39,49 @@ def load_config() -> dict:
     return config
 
 
+def create_db_connector(config: dict) -> SQLiteConnector:
+    """Create the connector to the SQLite database.
+
+    Args:
+        config (dict): The configuration values from the settings.json file.
+
+    Returns:
+        SQLiteConnector: The connector configured with the sqlite_* settings.
+    """
+    return SQLiteConnector(
+        database=config.get("sqlite_database", "data.db"),
+        journal_mode=config.get("sqlite_journal_mode", "WAL"),
+        synchronous=config.get("sqlite_synchronous", "NORMAL"),
+        busy_timeout=config.get("sqlite_busy_timeout", 5000),
+        cache_size=config.get("sqlite_cache_size", -2000),
+    )
+
+
+def configure_profiling(config: dict, process_name: str) -> None:
+    """Configure the profiler of the current process and let it be controlled with signals.
+
+    Args:
+        config (dict): The configuration values from the settings.json file.
+        process_name (str): The name of the process (used in the log and the names of the snapshot files).
+    """
+    PROFILER.configure(
+        process_name,
+        enabled=config.get("profiling", False),
+        slow_threshold=config.get("profiling_slow_threshold", 1.0),
+        sample_duration=config.get("profiling_sample_duration", 10),
+        output_folder=config.get("profiling_output_folder", "."),
+    )
+    PROFILER.install_signal_handlers()
+
+
 def run_guest_portal(config: dict):
     """Start the guest portal.
 
     Args:
         config (dict): The configuration values from the settings.json file.
     """
+    configure_profiling(config, "guest_portal")
+
     guest_portal = GuestPortal(
         portal_host=config.get("portal_host", "0.0.0.0"),
         portal_port=config.get("portal_port", "5000"),
@@ -50,6 +89,26 @@ def run_guest_portal(config: dict):
             "portal_go_online_url", "https://www.google.com"
         ),
         locale=config.get("locale", "en"),
+        bot_notification_socket=config.get(
+            "bot_notification_socket", "telegram_bot.sock"
+        ),
+        notification_socket=config.get(
+            "portal_notification_socket", "guest_portal.sock"
+        ),
+        long_poll_timeout=config.get("portal_long_poll_timeout", 25),
+        db_connector=create_db_connector(config),
+        reload_terms=config.get("portal_reload_terms", True),
+        server=config.get("portal_server", "waitress"),
+        threads=config.get("portal_threads", 16),
+        long_poll_threads=config.get("portal_long_poll_threads"),
+        connection_limit=config.get("portal_connection_limit", 100),
+        keep_alive_timeout=config.get("portal_keep_alive_timeout", 120),
+        page_cache=config.get("portal_page_cache", True),
+        mac_rate_limit=config.get("portal_mac_rate_limit", 5),
+        ip_rate_limit=config.get("portal_ip_rate_limit", 30),
+        coalesce_window=config.get("portal_coalesce_window", 3600),
+        metrics_host=config.get("metrics_host", "127.0.0.1"),
+        metrics_port=config.get("metrics_port", 9464),
     )
     guest_portal.run()
 
@@ -60,6 +119,8 @@ def run_telegram_bot(config: dict):
     Args:
         config (dict): The configuration values from the settings.json file.
     """
+    configure_profiling(config, "telegram_bot")
+
     bot_handler = TelegramBot(
         config["bot_password"],
         config["telegram_token"],
@@ -70,6 +131,25 @@ def run_telegram_bot(config: dict):
         unifi_ssl_verify=config.get("unifi_ssl_verify", True),
         locale=config.get("locale", "en"),
         bot_accept_options=config.get("bot_accept_options", [60, 1440, 4320, 10080]),
+        notification_socket=config.get("bot_notification_socket", "telegram_bot.sock"),
+        check_requests_interval=config.get("bot_check_requests_interval", 30),
+        portal_notification_socket=config.get(
+            "portal_notification_socket", "guest_portal.sock"
+        ),
+        db_connector=create_db_connector(config),
+        retention_days=config.get("retention_days", 30),
+        retention_interval=config.get("retention_interval", 3600),
+        max_concurrent_sends=config.get("bot_max_concurrent_sends", 8),
+        messages_per_second=config.get("bot_messages_per_second", 30),
+        chat_messages_per_minute=config.get("bot_chat_messages_per_minute", 20),
+        claim_batch_size=config.get("bot_claim_batch_size", 100),
+        claim_lease=config.get("bot_claim_lease", 300),
+        register_attempts=config.get("bot_register_attempts", 5),
+        register_period=config.get("bot_register_period", 900),
+        metrics_push_interval=config.get("bot_metrics_push_interval", 15),
+        telegram_base_url=config.get(
+            "telegram_base_url", "https://api.telegram.org/bot"
+        ),
     )
     bot_handler.run()
 
@@ -1,16 +1,37 @@
 import uuid
 import os
+import re
+import json
+import threading
+import time
 import markdown
 import warnings
 
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, g, request, render_template, jsonify
+from markupsafe import escape
+from waitress import create_server, serve
 
+from unifi_hotspot_telegram.metrics import REGISTRY
+from unifi_hotspot_telegram.profiling import PROFILER
+from unifi_hotspot_telegram.notifications import (
+    NotificationReceiver,
+    NotificationSender,
+    NotificationWaiter,
+)
+from unifi_hotspot_telegram.rate_limiter import RateLimiter
 from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
+from unifi_hotspot_telegram.static_assets import StaticAssetManager
 from unifi_hotspot_telegram.i18n_manager import I18nManager
 from unifi_hotspot_telegram.time_conversions import (
     convert_minutes_into_human_readable_string,
 )
 
+# Placeholder for the parameters of a guest in the cached form page (only letters and underscores, so Jinja doesn't escape it)
+FORM_PLACEHOLDER = "__form_parameter_{}__"
+FORM_PLACEHOLDER_PATTERN = re.compile(
+    r"__form_parameter_(unifi_site_id|id|locale|url)__"
+)
+
 
 class GuestPortal:
     def __init__(
@@ -19,6 +40,22 @@ class GuestPortal:
         portal_port: int = 5000,
         portal_go_online_url: str = "https://www.google.com",
         locale: str = "en",
+        bot_notification_socket: str = "telegram_bot.sock",
+        notification_socket: str = "guest_portal.sock",
+        long_poll_timeout: int = 25,
+        db_connector: SQLiteConnector = None,
+        reload_terms: bool = True,
+        server: str = "waitress",
+        threads: int = 16,
+        long_poll_threads: int = None,
+        connection_limit: int = 100,
+        keep_alive_timeout: int = 120,
+        page_cache: bool = True,
+        mac_rate_limit: int = 5,
+        ip_rate_limit: int = 30,
+        coalesce_window: int = 3600,
+        metrics_host: str = "127.0.0.1",
+        metrics_port: int = 9464,
     ) -> None:
         """Initialize the GuestPortal class.
 
@@ -27,14 +64,96 @@ class GuestPortal:
             portal_port (int, optional): The port to bind the Flask application to. Defaults to 5000.
             portal_go_online_url (str, optional): The URL to redirect to when the user clicks the "Go Online" button and there isn't a URL provided by UniFi. Defaults to 'https://www.google.com'.
             locale (str, optional): The locale to use then loading the portal without a specific language setting. Defaults to 'en'. Options are [de|en]
+            bot_notification_socket (str, optional): The path of the Unix socket to notify the telegram bot about new requests. Defaults to 'telegram_bot.sock'.
+            notification_socket (str, optional): The path of the Unix socket the telegram bot uses to notify the portal about confirmations. Defaults to 'guest_portal.sock'.
+            long_poll_timeout (int, optional): The maximum time (in seconds) a wait_update request is held open before the client has to ask again. Defaults to 25.
+            db_connector (SQLiteConnector, optional): The connector to the database. Defaults to a connector with the default settings.
+            reload_terms (bool, optional): Whether to check if a terms of use file was changed before using the cached HTML. Defaults to True.
+            server (str, optional): The server to run the Flask application with. Defaults to 'waitress'. Options are [waitress|flask] (flask is Flask's development server)
+            threads (int, optional): The number of threads handling requests (waitress only). Defaults to 16.
+            long_poll_threads (int, optional): The maximum number of threads held by waiting guests (waitress only). Further waiting guests ask for updates every second instead, so the other threads stay free for new guests. Defaults to half of threads.
+            connection_limit (int, optional): The maximum number of open connections (waitress only). Defaults to 100.
+            keep_alive_timeout (int, optional): The time (in seconds) an idle connection is kept open (waitress only). Defaults to 120.
+            page_cache (bool, optional): Whether to render the form once per locale and only fill in the parameters of the guest per request. Defaults to True.
+            mac_rate_limit (int, optional): The maximum number of requests per minute from the same MAC address. Defaults to 5. 0 disables the limit.
+            ip_rate_limit (int, optional): The maximum number of requests per minute from the same IP address. Defaults to 30. 0 disables the limit.
+            coalesce_window (int, optional): The time (in seconds) in which another request of a device with a pending request shows the pending request instead of creating a new one. Defaults to 3600. 0 always creates a new request.
+            metrics_host (str, optional): The host of the metrics endpoint (of the portal and the bot). Defaults to '127.0.0.1', so only local clients can read the metrics.
+            metrics_port (int, optional): The port of the metrics endpoint. Defaults to 9464. 0 disables the endpoint.
+
+        Raises:
+            ValueError: If the server is not supported or the long poll threads would leave no thread for other requests.
         """
+        if server not in ["waitress", "flask"]:
+            raise ValueError(
+                f"The server {server} is not supported. Options are ['waitress', 'flask']"
+            )
+
+        if long_poll_threads is None:
+            long_poll_threads = threads // 2
+        if server == "waitress" and not 0 <= long_poll_threads < threads:
+            raise ValueError(
+                f"The number of long poll threads ({long_poll_threads}) has to be between 0 and the number of threads ({threads}) minus 1, otherwise waiting guests lock new guests out of the portal."
+            )
+
         self.locale = locale
         self.portal_host = portal_host
         self.portal_port = portal_port
         self.portal_go_online_url = portal_go_online_url
-        self.app = Flask(__name__)
+        self.notification_socket = notification_socket
+        self.long_poll_timeout = long_poll_timeout
+        self.reload_terms = reload_terms
+        self.server = server
+        self.threads = threads
+        # Each open wait_update request occupies one of waitress' threads, so only some of them may be used for waiting
+        # (Flask's development server starts a thread per request, so it needs no limit)
+        self.long_poll_slots = (
+            threading.BoundedSemaphore(long_poll_threads)
+            if server == "waitress"
+            else None
+        )
+        self.connection_limit = connection_limit
+        self.keep_alive_timeout = keep_alive_timeout
+        self.page_cache = page_cache
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.bot_metrics = (
+            None  # dict: The latest metrics snapshot sent by the telegram bot
+        )
+        self.form_cache = (
+            {}
+        )  # dict: Maps a locale to the terms of use and the form rendered with them
+        # The static files are served by the StaticAssetManager (with compression and content hashes) instead of Flask
+        self.app = Flask(__name__, static_folder=None)
+        self.static_assets = StaticAssetManager(
+            os.path.join(self.app.root_path, "static")
+        )
         self.setup_routes()
-        self.db_connector = SQLiteConnector()
+        self.db_connector = (
+            db_connector if db_connector is not None else SQLiteConnector()
+        )
+        self.bot_notifier = NotificationSender(bot_notification_socket)
+        self.confirmation_waiter = None
+
+        # The translations are loaded once and shared by all requests (whatever their locale is)
+        self.i18n_manager = I18nManager(default_locale=locale)
+
+        # The supported locales and the terms of use are only read from the file system once
+        self.supported_locales = self.get_supported_locales()
+        self.terms_cache = (
+            {}
+        )  # dict: Maps a locale to the modification time of its terms of use file and their HTML
+        for supported_locale in self.supported_locales:
+            self.get_terms(supported_locale)
+
+        # The requests of each device and IP address are limited to protect the database and the admins' chats
+        self.mac_rate_limiter = (
+            RateLimiter(mac_rate_limit, 60) if mac_rate_limit > 0 else None
+        )
+        self.ip_rate_limiter = (
+            RateLimiter(ip_rate_limit, 60) if ip_rate_limit > 0 else None
+        )
+        self.coalesce_window = coalesce_window
 
     def __del__(self) -> None:
         """Clean up resources when the GuestPortal instance is deleted."""
@@ -42,6 +161,19 @@ class GuestPortal:
 
     def setup_routes(self) -> None:
         """Setup the routes for the Flask application."""
+        self.app.add_url_rule(
+            "/static/<path:filename>",
+            "static",
+            self.static_assets.serve,
+            methods=["GET"],
+        )
+        # Add the content hash to all URLs of static files, so browsers can cache them forever
+        self.app.url_defaults(self.static_assets.add_version)
+
+        # Measure the duration of every request
+        self.app.before_request(self.start_request_timer)
+        self.app.after_request(self.record_request_metrics)
+
         self.app.add_url_rule(
             "/guest/s/<unifi_site_id>/", "home", self.home, methods=["GET", "POST"]
         )
@@ -51,6 +183,36 @@ class GuestPortal:
             self.check_update,
             methods=["GET"],
         )
+        self.app.add_url_rule(
+            "/guest/s/<unifi_site_id>/wait_update/<unique_id>",
+            "wait_update",
+            self.wait_update,
+            methods=["GET"],
+        )
+
+    def start_request_timer(self) -> None:
+        """Remember when the handling of a request started (registered as before request function)."""
+        g.request_start = time.perf_counter()
+
+    def record_request_metrics(self, response: Response) -> Response:
+        """Record the duration and status of a request (registered as after request function).
+
+        Args:
+            response (flask.Response): The response to the request.
+
+        Returns:
+            flask.Response: The unchanged response.
+        """
+        route = request.endpoint or "unknown"
+        seconds = time.perf_counter() - g.request_start
+        REGISTRY.observe("portal_request_seconds", seconds, route=route)
+        PROFILER.check_operation(
+            f"{request.method} {request.path}", seconds, kwargs=request.args.to_dict()
+        )
+        REGISTRY.increment(
+            "portal_requests_total", route=route, status=response.status_code
+        )
+        return response
 
     def get_supported_locales(self) -> list:
         """Get a list of supported languages.
@@ -116,7 +278,7 @@ class GuestPortal:
             str: The HTML representation of the terms of use content.
         """
         # Check if the locale is supported
-        if locale not in self.get_supported_locales():
+        if locale not in self.supported_locales:
             warnings.warn(f"The locale {locale} is not supported.")
             # Use english as fallback as it is done in the I18nManager
             locale = "en"
@@ -124,6 +286,33 @@ class GuestPortal:
         # Check if there is a terms of use file for the default language
         file_path = f"unifi_hotspot_telegram/terms/terms_of_use.{locale}.md"
 
+        # Reuse the rendered terms of use (unless the file was changed since they were rendered)
+        cached_terms = self.terms_cache.get(locale)
+        if cached_terms is not None and not self.reload_terms:
+            return cached_terms[1]
+
+        try:
+            modification_time = os.stat(file_path).st_mtime_ns
+        except OSError:
+            modification_time = None
+
+        if cached_terms is not None and cached_terms[0] == modification_time:
+            return cached_terms[1]
+
+        html = self.render_terms(file_path, locale)
+        self.terms_cache[locale] = (modification_time, html)
+        return html
+
+    def render_terms(self, file_path: str, locale: str) -> str:
+        """Read a terms of use file and convert it into HTML.
+
+        Args:
+            file_path (str): The path of the markdown file.
+            locale (str): The locale of the terms of use (for the warnings).
+
+        Returns:
+            str: The HTML representation of the terms of use content.
+        """
         # Read the file if it exists
         if os.path.isfile(file_path):
             with open(file_path, "r", encoding="utf-8") as file:
@@ -145,6 +334,26 @@ class GuestPortal:
         # Return an empty string if there are no terms of use to display
         return ""
 
+    def is_request_allowed(self, mac: str, ip_address: str) -> bool:
+        """Check whether a device may submit another request.
+
+        Args:
+            mac (str): The MAC address of the device.
+            ip_address (str): The IP address the request comes from.
+
+        Returns:
+            bool: True if neither the limit per MAC address nor the limit per IP address is exceeded.
+        """
+        if self.mac_rate_limiter is not None and mac:
+            if not self.mac_rate_limiter.consume(mac):
+                return False
+
+        if self.ip_rate_limiter is not None and ip_address:
+            if not self.ip_rate_limiter.consume(ip_address):
+                return False
+
+        return True
+
     def home(self, unifi_site_id: str) -> str:
         """Handle the home route.
 
@@ -159,8 +368,8 @@ class GuestPortal:
             locale = request.args.get("lang")
         else:
             locale = self.locale
-        # Initialize the i18n manager
-        i18n_manager = I18nManager(default_locale=locale)
+        # Use the shared i18n manager with the locale of the request
+        i18n_manager = self.i18n_manager.for_locale(locale)
 
         # If there is a POST request, the form is already submitted so we can show the wait page
         if request.method == "POST":
@@ -174,9 +383,27 @@ class GuestPortal:
                 # Otherwise use the default URL
                 url = self.portal_go_online_url
 
-            unique_id = uuid.uuid4().hex
+            # Limit the number of requests per device and per IP address (before touching the database)
+            if not self.is_request_allowed(mac, request.remote_addr):
+                return (
+                    i18n_manager.translate("guest_portal.home_too_many_requests"),
+                    429,
+                )
+
+            # Show the pending request of the device again instead of asking the admins a second time
+            unique_id = None
+            if mac and self.coalesce_window > 0:
+                unique_id = self.db_connector.get_pending_request_id(
+                    mac, self.coalesce_window
+                )
+
+            if unique_id is None:
+                unique_id = uuid.uuid4().hex
 
-            self.db_connector.add_request(unique_id, name, mac)
+                self.db_connector.add_request(unique_id, name, mac)
+
+                # Wake up the telegram bot so the request is sent immediately (if this fails, the bot's regular check picks it up)
+                self.bot_notifier.notify("new_request", unique_id)
 
             return render_template(
                 "wait.html",
@@ -191,15 +418,66 @@ class GuestPortal:
         mac = request.args.get("id")
         url = request.args.get("url")
 
-        return render_template(
-            "form.html",
-            unifi_site_id=unifi_site_id,
-            id=mac,
-            locale=locale,
-            url=url,
-            supported_locales=self.get_supported_locales(),
-            terms_of_use=self.get_terms(locale),
-            i18n_manager=i18n_manager,
+        if not self.page_cache:
+            return render_template(
+                "form.html",
+                unifi_site_id=unifi_site_id,
+                id=mac,
+                locale=locale,
+                url=url,
+                supported_locales=self.supported_locales,
+                terms_of_use=self.get_terms(locale),
+                i18n_manager=i18n_manager,
+            )
+
+        return self.render_cached_form(unifi_site_id, mac, locale, url)
+
+    def render_cached_form(
+        self, unifi_site_id: str, mac: str, locale: str, url: str
+    ) -> str:
+        """Render the form from a cached page that only depends on the locale (and the terms of use).
+
+        The cached page contains placeholders for the parameters of the guest, which are replaced (escaped as Jinja would) per request.
+
+        Args:
+            unifi_site_id (str): The ID of the Unifi site.
+            mac (str): The MAC address of the guest.
+            locale (str): The locale of the request.
+            url (str): The URL to redirect to after the guest is online.
+
+        Returns:
+            str: The rendered form.
+        """
+        terms_of_use = self.get_terms(locale)
+
+        # Unsupported locales are all translated with the fallback locale, so they share one cached page
+        cache_key = locale if locale in self.supported_locales else None
+        cached_page = self.form_cache.get(cache_key)
+
+        # Render the page again if the terms of use were changed
+        if cached_page is None or cached_page[0] is not terms_of_use:
+            page = render_template(
+                "form.html",
+                unifi_site_id=FORM_PLACEHOLDER.format("unifi_site_id"),
+                id=FORM_PLACEHOLDER.format("id"),
+                locale=FORM_PLACEHOLDER.format("locale"),
+                url=FORM_PLACEHOLDER.format("url"),
+                supported_locales=self.supported_locales,
+                terms_of_use=terms_of_use,
+                i18n_manager=self.i18n_manager.for_locale(locale),
+            )
+            cached_page = (terms_of_use, page)
+            self.form_cache[cache_key] = cached_page
+
+        parameters = {
+            "unifi_site_id": unifi_site_id,
+            "id": mac,
+            "locale": locale,
+            "url": url,
+        }
+        # Replace all placeholders in one pass, so a parameter containing a placeholder is not replaced again
+        return FORM_PLACEHOLDER_PATTERN.sub(
+            lambda match: str(escape(parameters[match.group(1)])), cached_page[1]
         )
 
     def check_update(self, unifi_site_id: str, unique_id: str) -> dict:
@@ -215,6 +493,85 @@ class GuestPortal:
         # Check if there is a result for the unique ID
         result = self.db_connector.get_confirmation(unique_id)
 
+        return self.get_update_response(result)
+
+    def wait_update(self, unifi_site_id: str, unique_id: str) -> dict:
+        """Wait for an update (long polling).
+
+        The request is held open until the request was confirmed/denied or the long poll timeout is reached,
+        so waiting guests don't have to ask for updates every second.
+
+        Args:
+            unifi_site_id (str): The ID of the Unifi site.
+            unique_id (str): The unique ID.
+
+        Returns:
+            dict: A JSON response containing the duration and human-readable duration if available.
+        """
+        deadline = time.monotonic() + self.long_poll_timeout
+
+        # Only hold the request open if a thread is left for waiting guests
+        if self.long_poll_slots is not None and not self.long_poll_slots.acquire(
+            blocking=False
+        ):
+            result = self.db_connector.get_confirmation(unique_id)
+            if result:
+                return self.get_update_response(result)
+
+            # The waiting page falls back to asking for updates every second (which only occupies a thread briefly)
+            REGISTRY.increment("portal_long_polls_rejected_total")
+            return Response(status=503, headers={"Retry-After": "1"})
+
+        # Count the guests waiting for a decision right now
+        REGISTRY.add_to_gauge("portal_waiting_guests", 1)
+        try:
+            return self.wait_for_confirmation(unique_id, deadline)
+        finally:
+            REGISTRY.add_to_gauge("portal_waiting_guests", -1)
+            if self.long_poll_slots is not None:
+                self.long_poll_slots.release()
+
+    def wait_for_confirmation(self, unique_id: str, deadline: float) -> dict:
+        """Wait until a request was confirmed/denied or the deadline is reached.
+
+        Args:
+            unique_id (str): The unique ID.
+            deadline (float): The time (of time.monotonic) until which to wait.
+
+        Returns:
+            dict: A JSON response containing the duration and human-readable duration if available.
+        """
+        if self.confirmation_waiter is None:
+            # Without notifications of the telegram bot we have to check the database regularly ourselves
+            result = self.db_connector.get_confirmation(unique_id)
+            while not result and time.monotonic() < deadline:
+                time.sleep(1)
+                result = self.db_connector.get_confirmation(unique_id)
+
+            return self.get_update_response(result)
+
+        # Register before checking the database so a confirmation in between is not missed
+        event = self.confirmation_waiter.register(unique_id)
+        try:
+            result = self.db_connector.get_confirmation(unique_id)
+            if not result:
+                event.wait(max(0, deadline - time.monotonic()))
+                # Check the database again after a timeout too, in case a notification got lost
+                result = self.db_connector.get_confirmation(unique_id)
+        finally:
+            self.confirmation_waiter.unregister(unique_id, event)
+
+        return self.get_update_response(result)
+
+    def get_update_response(self, result: dict) -> dict:
+        """Build the JSON response of the check_update and wait_update routes.
+
+        Args:
+            result (dict): The confirmation of the request as returned by SQLiteConnector.get_confirmation, or None.
+
+        Returns:
+            dict: A JSON response containing the duration and human-readable duration if available.
+        """
         if result:
             # Check if the duration is above 0
             if result["duration"] > 0:
@@ -224,8 +581,8 @@ class GuestPortal:
                 else:
                     locale = self.locale
 
-                # Initialize the i18n manager
-                i18n_manager = I18nManager(default_locale=locale)
+                # Use the shared i18n manager with the locale of the request
+                i18n_manager = self.i18n_manager.for_locale(locale)
 
                 return jsonify(
                     {
@@ -240,7 +597,78 @@ class GuestPortal:
         else:
             return jsonify({})
 
+    def start_notification_listener(self) -> None:
+        """Listen for notifications of the telegram bot about confirmed/denied requests."""
+        try:
+            receiver = NotificationReceiver(self.notification_socket)
+        except (AttributeError, OSError) as e:
+            warnings.warn(
+                f"Could not listen for notifications on {self.notification_socket} ({e}). Waiting guests will check the database regularly instead."
+            )
+            return
+
+        self.confirmation_waiter = NotificationWaiter(receiver, "confirmation")
+        # The telegram bot sends its metrics on the same socket
+        self.confirmation_waiter.add_handler("metrics", self.receive_bot_metrics)
+
+    def receive_bot_metrics(self, payload: str) -> None:
+        """Store the metrics snapshot sent by the telegram bot.
+
+        Args:
+            payload (str): The snapshot as JSON (see MetricsRegistry.snapshot).
+        """
+        try:
+            self.bot_metrics = json.loads(payload)
+        except ValueError:
+            warnings.warn("Received invalid metrics from the telegram bot.")
+
+    def metrics(self) -> Response:
+        """Handle the metrics route.
+
+        Returns:
+            flask.Response: The metrics of the portal and the telegram bot in the Prometheus text format.
+        """
+        bot_metrics = self.bot_metrics
+        return Response(
+            REGISTRY.render([bot_metrics] if bot_metrics is not None else []),
+            mimetype="text/plain; version=0.0.4",
+        )
+
+    def start_metrics_server(self) -> None:
+        """Serve the metrics on a separate (by default local-only) port, so guests can't read them."""
+        if self.metrics_port == 0:
+            return
+
+        metrics_app = Flask(__name__ + ".metrics", static_folder=None)
+        metrics_app.add_url_rule("/metrics", "metrics", self.metrics, methods=["GET"])
+
+        try:
+            server = create_server(
+                metrics_app, host=self.metrics_host, port=self.metrics_port, threads=1
+            )
+        except OSError as e:
+            warnings.warn(
+                f"Could not serve the metrics on {self.metrics_host}:{self.metrics_port} ({e})."
+            )
+            return
+
+        threading.Thread(target=server.run, daemon=True).start()
+
     def run(self):
         """Run the Flask application."""
-        # Normally Flask should not be used in production mode, but in this case we don't expect a lot of traffic so it should be fine
-        self.app.run(host=self.portal_host, port=self.portal_port, debug=False)
+        self.start_notification_listener()
+        self.start_metrics_server()
+
+        if self.server == "waitress":
+            # Each of waitress' threads uses its own SQLite connection (see SQLiteConnector.get_conn)
+            serve(
+                self.app,
+                host=self.portal_host,
+                port=self.portal_port,
+                threads=self.threads,
+                connection_limit=self.connection_limit,
+                channel_timeout=self.keep_alive_timeout,
+            )
+        else:
+            # Flask's development server starts a new thread per request, which is fine for little traffic
+            self.app.run(host=self.portal_host, port=self.portal_port, debug=False)
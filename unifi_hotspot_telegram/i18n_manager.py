@@ -1,4 +1,17 @@
-import i18n
+import copy
+import json
+import os
+
+from string import Template
+from types import MappingProxyType
+
+# The keys of a dictionary with plural forms of a translation
+PLURAL_FORMS = ["zero", "one", "few", "many", "other"]
+
+
+class TranslationTemplate(Template):
+    # Placeholders in the translations look like %{name}
+    delimiter = "%"
 
 
 class I18nManager:
@@ -6,15 +19,18 @@ class I18nManager:
         self,
         default_locale: str = "en",
         fallback_locale: str = "en",
-        supported_locales: list = ["en", "de"],
+        supported_locales: list = None,
         translation_path: str = "unifi_hotspot_telegram/translations",
     ) -> None:
         """Initialize the I18nManager class.
 
+        All translation files (named [namespace].[locale].json) are loaded once into an immutable catalog, so the
+        I18nManager can be shared between threads and translate for different locales at the same time.
+
         Args:
             default_locale (str): The default locale. Defaults to 'en'.
             fallback_locale (str): The fallback locale. Defaults to 'en'.
-            supported_locales (list): A list of supported locales. Defaults to ['en', 'de'].
+            supported_locales (list): A list of locales to load the translations for. Defaults to None (all locales with translation files).
             translation_path (str): The path to the translation files. Defaults to 'unifi_hotspot_telegram/translations'.
         """
         self.default_locale = default_locale  # str: The default locale
@@ -24,26 +40,148 @@ class I18nManager:
             translation_path  # str: The path to the translation files
         )
 
-        self.setup_i18n()  # Setup i18n
+        self.catalog = self.load_catalog()  # Load all translations
+
+    def load_catalog(self) -> MappingProxyType:
+        """Load all translation files of the supported locales.
+
+        Returns:
+            MappingProxyType: A read-only mapping of each locale to a read-only mapping of the translation keys
+                (e.g. 'guest_portal.home_description') to their translations.
+        """
+        catalog = {}
+
+        for filename in sorted(os.listdir(self.translation_path)):
+            parts = filename.split(".")
+            if len(parts) != 3 or parts[2] != "json":
+                continue
+
+            namespace, locale = parts[0], parts[1]
+            if (
+                self.supported_locales is not None
+                and locale not in self.supported_locales
+            ):
+                continue
+
+            with open(
+                os.path.join(self.translation_path, filename), encoding="utf-8"
+            ) as file:
+                # The translations of a file are nested under the locale
+                translations = json.load(file)[locale]
+
+            self.flatten_translations(
+                translations, namespace, catalog.setdefault(locale, {})
+            )
+
+        return MappingProxyType(
+            {
+                locale: MappingProxyType(translations)
+                for locale, translations in catalog.items()
+            }
+        )
+
+    def flatten_translations(self, translations: dict, prefix: str, result: dict):
+        """Add nested translations to a dictionary with dot-separated keys.
+
+        Args:
+            translations (dict): The (nested) translations.
+            prefix (str): The key prefix of the translations (e.g. the namespace).
+            result (dict): The dictionary to add the translations to.
+        """
+        for key, value in translations.items():
+            # A dictionary with plural forms is a single translation, other dictionaries are nested keys
+            if (
+                isinstance(value, dict)
+                and len(set(PLURAL_FORMS).intersection(value)) < 2
+            ):
+                self.flatten_translations(value, f"{prefix}.{key}", result)
+            else:
+                result[f"{prefix}.{key}"] = value
+
+    def __eq__(self, other) -> bool:
+        """Compare two I18nManagers by their translations (two managers are equal if they translate the same way).
+
+        Args:
+            other: The object to compare with.
+
+        Returns:
+            bool: True if both share the loaded translations and use the same locales.
+        """
+        if not isinstance(other, I18nManager):
+            return NotImplemented
+
+        return (
+            self.catalog is other.catalog
+            and self.default_locale == other.default_locale
+            and self.fallback_locale == other.fallback_locale
+        )
+
+    def __hash__(self) -> int:
+        """Hash the I18nManager consistently with __eq__ (so translations can be cached per manager and locale).
+
+        Returns:
+            int: The hash value.
+        """
+        return hash((id(self.catalog), self.default_locale, self.fallback_locale))
+
+    def for_locale(self, locale: str) -> "I18nManager":
+        """Get an I18nManager with another default locale that shares the loaded translations.
 
-    def setup_i18n(self) -> None:
-        """Setup i18n with the configured settings."""
-        i18n.set("locale", self.default_locale)
-        i18n.set("fallback", self.fallback_locale)
-        i18n.set("supported_locales", self.supported_locales)
-        i18n.set("file_format", "json")
+        Args:
+            locale (str): The default locale of the new I18nManager.
 
-        if self.translation_path:
-            i18n.load_path.append(self.translation_path)
+        Returns:
+            I18nManager: The I18nManager for the locale.
+        """
+        i18n_manager = copy.copy(self)
+        i18n_manager.default_locale = locale
+        return i18n_manager
 
-    def translate(self, message: str, **kwargs) -> str:
-        """Translate a message using the configured locale.
+    def translate(self, message: str, locale: str = None, **kwargs) -> str:
+        """Translate a message.
 
         Args:
             message (str): The message to be translated.
-            **kwargs: Additional keyword arguments for message interpolation.
+            locale (str, optional): The locale to translate to. Defaults to the default locale.
+            **kwargs: Additional keyword arguments for message interpolation. 'count' also selects the plural form.
 
         Returns:
-            str: The translated message.
+            str: The translated message (or the message itself if there is no translation, not even in the fallback locale).
         """
-        return i18n.t(message, **kwargs)
+        if locale is None:
+            locale = self.default_locale
+
+        translation = self.catalog.get(locale, {}).get(message)
+        if translation is None:
+            translation = self.catalog.get(self.fallback_locale, {}).get(message)
+            if translation is None:
+                return message
+
+        if "count" in kwargs:
+            translation = self.pluralize(translation, kwargs["count"])
+            if translation is None:
+                return message
+
+        return TranslationTemplate(translation).safe_substitute(**kwargs)
+
+    def pluralize(self, translation, count: int) -> str:
+        """Select the plural form of a translation.
+
+        Args:
+            translation: The translation, a dictionary with the plural forms or a string.
+            count (int): The count to select the plural form for.
+
+        Returns:
+            str: The plural form, or None if there is no matching plural form.
+        """
+        if not isinstance(translation, dict):
+            return translation
+
+        if count == 0 and "zero" in translation:
+            return translation["zero"]
+        if count == 1 and "one" in translation:
+            return translation["one"]
+        if count not in (0, 1) and count <= 5 and "few" in translation:
+            return translation["few"]
+
+        return translation.get("other", translation.get("many"))
@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import functools
+import time
+
+from contextlib import contextmanager
+from threading import Lock
+
+from unifi_hotspot_telegram.profiling import PROFILER
+
+# The upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """Initialize the MetricsRegistry class.
+
+        The MetricsRegistry collects counters, gauges and latency histograms of one process. Each metric is identified
+        by its name and its labels (e.g. `sqlite_query_seconds{query="get_confirmation"}`). The snapshots of other
+        processes can be added to the output of render, so one endpoint shows the metrics of the portal and the bot.
+        """
+        self.counters = {}  # dict: Maps a name and labels to the value of a counter
+        self.gauges = {}  # dict: Maps a name and labels to the value of a gauge
+        # Maps a name and labels to the bucket counts, the sum and the count of a histogram
+        self.histograms = {}
+        self.lock = Lock()
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """Increase a counter.
+
+        Args:
+            name (str): The name of the counter (ending with '_total' by convention).
+            value (float, optional): The amount to increase the counter by. Defaults to 1.
+            **labels: The labels of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_to_gauge(self, name: str, value: float, **labels) -> None:
+        """Increase (or with a negative value decrease) a gauge.
+
+        Args:
+            name (str): The name of the gauge.
+            value (float): The amount to add to the gauge.
+            **labels: The labels of the gauge.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Add a duration to a latency histogram.
+
+        Args:
+            name (str): The name of the histogram (ending with '_seconds' by convention).
+            seconds (float): The observed duration.
+            **labels: The labels of the histogram.
+        """
+        self.observe_key((name, tuple(sorted(labels.items()))), seconds)
+
+    def observe_key(self, key: tuple, seconds: float) -> None:
+        """Add a duration to a latency histogram identified by a precomputed key (faster for frequent calls).
+
+        Args:
+            key (tuple): The name of the histogram and its labels as sorted tuple of name and value pairs.
+            seconds (float): The observed duration.
+        """
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # The last bucket counts the durations above the largest bound
+                histogram = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+                self.histograms[key] = histogram
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Measure the duration of a block and add it to a latency histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            **labels: The labels of the histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            PROFILER.check_operation(
+                name + format_labels(tuple(labels.items())), seconds
+            )
+
+    def snapshot(self) -> dict:
+        """Get the current values of all metrics.
+
+        Returns:
+            dict: The counters, gauges and histograms as lists (with the labels as dictionaries), so the snapshot
+                can be serialized as JSON and sent to another process.
+        """
+        with self.lock:
+            return {
+                "counters": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "gauges": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self.gauges.items()
+                ],
+                "histograms": [
+                    [name, dict(labels), list(histogram[0]), histogram[1], histogram[2]]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def render(self, other_snapshots: list = []) -> str:
+        """Render the metrics in the Prometheus text format.
+
+        Args:
+            other_snapshots (list, optional): Snapshots of other processes, whose values are added to the values of
+                this registry. Defaults to [].
+
+        Returns:
+            str: The metrics in the Prometheus text format.
+        """
+        # Sum up the metrics of all processes
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in [self.snapshot()] + list(other_snapshots):
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, tuple(sorted(labels.items())))
+                gauges[key] = gauges.get(key, 0) + value
+            for name, labels, buckets, total, count in snapshot["histograms"]:
+                key = (name, tuple(sorted(labels.items())))
+                merged = histograms.setdefault(
+                    key, [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+                )
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+
+        lines = []
+        for metric_type, metrics in [("counter", counters), ("gauge", gauges)]:
+            last_name = None
+            for (name, labels), value in sorted(metrics.items()):
+                if name != last_name:
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    last_name = name
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+        last_name = None
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            if name != last_name:
+                lines.append(f"# TYPE {name} histogram")
+                last_name = name
+
+            # The buckets of the text format are cumulative
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ["+Inf"], buckets):
+                cumulative += bucket_count
+                bucket_labels = format_labels(labels + (("le", str(bound)),))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple) -> str:
+    """Format the labels of a metric for the Prometheus text format.
+
+    Args:
+        labels (tuple): The labels as sorted tuple of name and value pairs.
+
+    Returns:
+        str: The labels in curly braces (e.g. '{query="get_request"}'), or an empty string if there are no labels.
+    """
+    if len(labels) == 0:
+        return ""
+
+    formatted = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + formatted + "}"
+
+
+def timed(name: str, **labels):
+    """Decorate a function (or coroutine function) to add the duration of each call to a latency histogram.
+
+    Args:
+        name (str): The name of the histogram.
+        **labels: The labels of the histogram.
+
+    Returns:
+        The decorator.
+    """
+
+    # The key of the histogram is the same for every call
+    key = (name, tuple(sorted(labels.items())))
+    operation = name + format_labels(key[1])
+
+    def decorator(function):
+        # The instance of a method is not worth logging as parameter of a slow call
+        skipped_args = 1 if function.__code__.co_varnames[:1] == ("self",) else 0
+
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    seconds = time.perf_counter() - start
+                    REGISTRY.observe_key(key, seconds)
+                    PROFILER.check_operation(
+                        operation, seconds, args[skipped_args:], kwargs
+                    )
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                REGISTRY.observe_key(key, seconds)
+                PROFILER.check_operation(
+                    operation, seconds, args[skipped_args:], kwargs
+                )
+
+        return wrapper
+
+    return decorator
+
+
+# The registry of the process (the portal and the bot run in separate processes, so each has its own registry)
+REGISTRY = MetricsRegistry()
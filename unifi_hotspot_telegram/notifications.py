@@ -0,0 +1,186 @@
+import os
+import select
+import socket
+import threading
+import warnings
+
+from typing import List, Tuple
+
+
+class NotificationSender:
+    def __init__(self, socket_path: str) -> None:
+        """Initialize the NotificationSender class.
+
+        Args:
+            socket_path (str): The path of the Unix socket the notifications are sent to.
+        """
+        self.socket_path = socket_path
+        self.socket = None
+
+        if hasattr(socket, "AF_UNIX"):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            # Never block the caller (e.g. a Flask request) if the receiver is slow or not running
+            self.socket.setblocking(False)
+        else:
+            warnings.warn(
+                "Unix sockets are not supported on this platform. Notifications are disabled."
+            )
+
+    def __del__(self) -> None:
+        """Close the socket when the NotificationSender instance is deleted."""
+        if self.socket is not None:
+            self.socket.close()
+
+    def notify(self, topic: str, payload: str = "") -> bool:
+        """Send a notification to the receiver.
+
+        Notifications are best effort: If the receiver is not running or its buffer is full the notification is dropped,
+        so the receiver must always have another way (e.g. a periodic database check) to pick up the information.
+
+        Args:
+            topic (str): The topic of the notification (e.g. "new_request").
+            payload (str, optional): Additional data for the notification. Defaults to ''.
+
+        Returns:
+            bool: True if the notification was sent, False if it was dropped.
+        """
+        if self.socket is None:
+            return False
+
+        try:
+            self.socket.sendto(f"{topic}\n{payload}".encode("utf-8"), self.socket_path)
+            return True
+        except OSError:
+            # The receiver is not running (yet) or is too slow to keep up
+            return False
+
+
+class NotificationReceiver:
+    def __init__(self, socket_path: str) -> None:
+        """Initialize the NotificationReceiver class.
+
+        Args:
+            socket_path (str): The path of the Unix socket to listen on.
+        """
+        self.socket_path = socket_path
+
+        # Remove a socket file that was left behind by a previous run
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.socket_path)
+        self.socket.setblocking(False)
+
+    def __del__(self) -> None:
+        """Close the socket when the NotificationReceiver instance is deleted."""
+        self.close()
+
+    def close(self) -> None:
+        """Close the socket and remove the socket file."""
+        if self.socket.fileno() != -1:
+            self.socket.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def fileno(self) -> int:
+        """Get the file descriptor of the socket (e.g. to wait for notifications with select or asyncio).
+
+        Returns:
+            int: The file descriptor of the socket.
+        """
+        return self.socket.fileno()
+
+    def receive(self) -> List[Tuple[str, str]]:
+        """Receive all pending notifications without blocking.
+
+        Returns:
+            List[Tuple[str, str]]: A list of notifications, each represented as a tuple of topic and payload.
+        """
+        notifications = []
+
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+
+            topic, _, payload = data.decode("utf-8").partition("\n")
+            notifications.append((topic, payload))
+
+        return notifications
+
+
+class NotificationWaiter:
+    def __init__(self, receiver: NotificationReceiver, topic: str) -> None:
+        """Initialize the NotificationWaiter class and start listening for notifications in a background thread.
+
+        Args:
+            receiver (NotificationReceiver): The receiver to read the notifications from.
+            topic (str): The topic of the notifications that can be waited for.
+        """
+        self.receiver = receiver
+        self.topic = topic
+        self.waiters = {}  # dict: Maps a payload to the set of events waiting for it
+        self.handlers = (
+            {}
+        )  # dict: Maps another topic to the function handling its payloads
+        self.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def listen(self) -> None:
+        """Wake up all threads waiting for a payload once a notification with that payload arrives."""
+        while True:
+            select.select([self.receiver], [], [])
+
+            for topic, payload in self.receiver.receive():
+                if topic != self.topic:
+                    if topic in self.handlers:
+                        self.handlers[topic](payload)
+                    continue
+
+                with self.lock:
+                    for event in self.waiters.get(payload, ()):
+                        event.set()
+
+    def add_handler(self, topic: str, handler) -> None:
+        """Handle the notifications of another topic (that arrive on the same socket) with a function.
+
+        Args:
+            topic (str): The topic of the notifications.
+            handler: The function to call with the payload of each notification (in the listening thread).
+        """
+        self.handlers[topic] = handler
+
+    def register(self, payload: str) -> threading.Event:
+        """Register interest in a payload.
+
+        The event should be registered before checking whether the awaited information is already present,
+        otherwise a notification arriving in between is lost.
+
+        Args:
+            payload (str): The payload to wait for.
+
+        Returns:
+            threading.Event: An event that is set once a notification with the payload arrives.
+        """
+        event = threading.Event()
+        with self.lock:
+            self.waiters.setdefault(payload, set()).add(event)
+        return event
+
+    def unregister(self, payload: str, event: threading.Event) -> None:
+        """Remove an event that was registered with register.
+
+        Args:
+            payload (str): The payload the event was registered for.
+            event (threading.Event): The event returned by register.
+        """
+        with self.lock:
+            events = self.waiters.get(payload)
+            if events is not None:
+                events.discard(event)
+                if not events:
+                    del self.waiters[payload]
@@ -0,0 +1,174 @@
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import warnings
+
+# The maximum length of the parameters of a slow operation in the log
+MAX_PARAMETERS_LENGTH = 200
+
+
+class Profiler:
+    def __init__(self) -> None:
+        """Initialize the Profiler class.
+
+        The Profiler logs operations (measured by the metrics, see unifi_hotspot_telegram.metrics) that take longer
+        than a threshold and takes sampling snapshots of all threads of the process. Both can be triggered at runtime
+        with signals (see install_signal_handlers), so a running portal or bot can be inspected without a restart.
+        """
+        self.enabled = False  # bool: Whether slow operations are logged
+        # The duration (in seconds) from which on an operation is slow
+        self.slow_threshold = 1.0
+        # The duration of a sampling snapshot and the time between two of its samples (in seconds)
+        self.sample_duration = 10.0
+        self.sample_interval = 0.01
+        # The folder the sampling snapshots are written to
+        self.output_folder = "."
+        # The name of the process in the log and the snapshot file names
+        self.process_name = "process"
+        self.sampling = threading.Lock()  # Held while a sampling snapshot is taken
+        self.logger = logging.getLogger(__name__)
+
+    def configure(
+        self,
+        process_name: str,
+        enabled: bool = False,
+        slow_threshold: float = 1.0,
+        sample_duration: float = 10.0,
+        output_folder: str = ".",
+    ) -> None:
+        """Configure the Profiler of the process.
+
+        Args:
+            process_name (str): The name of the process (e.g. 'guest_portal').
+            enabled (bool, optional): Whether slow operations are logged from the start. Defaults to False.
+            slow_threshold (float, optional): The duration (in seconds) from which on an operation is logged. Defaults to 1.0.
+            sample_duration (float, optional): The duration (in seconds) of a sampling snapshot. Defaults to 10.0.
+            output_folder (str, optional): The folder the sampling snapshots are written to. Defaults to '.'.
+        """
+        self.process_name = process_name
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.sample_duration = sample_duration
+        self.output_folder = output_folder
+
+    def install_signal_handlers(self) -> None:
+        """Toggle the logging of slow operations on SIGUSR1 and take a sampling snapshot on SIGUSR2.
+
+        Must be called from the main thread of the process.
+        """
+        if not hasattr(signal, "SIGUSR1"):
+            warnings.warn(
+                "Signals are not supported on this platform. Profiling can only be enabled in the settings."
+            )
+            return
+
+        signal.signal(signal.SIGUSR1, self.toggle)
+        signal.signal(signal.SIGUSR2, self.start_sampling)
+
+    def toggle(self, signum: int = None, frame=None) -> None:
+        """Turn the logging of slow operations on or off (used as signal handler).
+
+        Args:
+            signum (int, optional): The number of the received signal. Defaults to None.
+            frame (optional): The interrupted stack frame. Defaults to None.
+        """
+        self.enabled = not self.enabled
+        self.logger.warning(
+            f"Logging of slow operations (>= {self.slow_threshold} s) in {self.process_name} is now {'on' if self.enabled else 'off'}."
+        )
+
+    def check_operation(
+        self, operation: str, seconds: float, args: tuple = (), kwargs: dict = {}
+    ) -> None:
+        """Log an operation if it was slow and the logging of slow operations is on.
+
+        Args:
+            operation (str): The name of the operation (e.g. 'sqlite_query_seconds{query="get_request"}').
+            seconds (float): The duration of the operation.
+            args (tuple, optional): The positional parameters of the operation. Defaults to ().
+            kwargs (dict, optional): The keyword parameters of the operation. Defaults to {}.
+        """
+        if not self.enabled or seconds < self.slow_threshold:
+            return
+
+        parameters = ", ".join(
+            [repr(arg) for arg in args]
+            + [f"{name}={value!r}" for name, value in kwargs.items()]
+        )
+        if len(parameters) > MAX_PARAMETERS_LENGTH:
+            parameters = parameters[:MAX_PARAMETERS_LENGTH] + "..."
+
+        self.logger.warning(
+            f"Slow operation in {self.process_name}: {operation} took {seconds:.3f} s ({parameters})"
+        )
+
+    def start_sampling(self, signum: int = None, frame=None) -> None:
+        """Take a sampling snapshot in a background thread (used as signal handler).
+
+        Args:
+            signum (int, optional): The number of the received signal. Defaults to None.
+            frame (optional): The interrupted stack frame. Defaults to None.
+        """
+        threading.Thread(target=self.sample, daemon=True).start()
+
+    def sample(self) -> str:
+        """Record the stacks of all threads regularly for the sample duration and write them to a file.
+
+        The file contains one line per distinct stack, the functions from the outermost to the innermost separated by
+        semicolons, followed by the number of samples (the "collapsed stack" format read by flame graph tools).
+
+        Returns:
+            str: The path of the written file, or None if another snapshot is being taken.
+        """
+        if not self.sampling.acquire(blocking=False):
+            self.logger.warning("A sampling snapshot is already being taken.")
+            return None
+
+        try:
+            own_thread = threading.get_ident()
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            stacks = collections.Counter()
+
+            self.logger.warning(
+                f"Taking a sampling snapshot of {self.process_name} for {self.sample_duration} s."
+            )
+            deadline = time.monotonic() + self.sample_duration
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+
+                    functions = []
+                    while frame is not None:
+                        code = frame.f_code
+                        functions.append(
+                            f"{code.co_name} ({os.path.basename(code.co_filename)})"
+                        )
+                        frame = frame.f_back
+                    functions.append(thread_names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(functions))] += 1
+
+                time.sleep(self.sample_interval)
+
+            path = os.path.join(
+                self.output_folder,
+                f"profile-{self.process_name}-{os.getpid()}-{int(time.time())}.txt",
+            )
+            with open(path, "w", encoding="utf-8") as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+
+            self.logger.warning(f"Wrote the sampling snapshot to {path}.")
+            return path
+        finally:
+            self.sampling.release()
+
+
+# The profiler of the process (the portal and the bot run in separate processes, so each has its own profiler)
+PROFILER = Profiler()
@@ -0,0 +1,86 @@
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class RateLimiter:
+    def __init__(self, limit: int, period: float, max_keys: int = 10000) -> None:
+        """Initialize the RateLimiter class.
+
+        The RateLimiter keeps a token bucket per key (e.g. per IP address): Each bucket holds up to `limit` tokens and
+        is refilled with `limit` tokens per `period`. Only the most recently used `max_keys` buckets are kept, so the
+        memory usage is bounded even if the keys are chosen by an attacker.
+
+        Args:
+            limit (int): The maximum number of actions in a burst and per period.
+            period (float): The period (in seconds) in which the bucket is refilled completely.
+            max_keys (int, optional): The maximum number of buckets kept in memory. Defaults to 10000.
+        """
+        self.limit = limit
+        self.refill_rate = limit / period  # float: Tokens per second
+        self.max_keys = max_keys
+        # Maps a key to its tokens and the time they were counted (least recently used first)
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def consume(self, key) -> bool:
+        """Take a token from the bucket of a key.
+
+        Args:
+            key: The key to limit the actions of (e.g. an IP address).
+
+        Returns:
+            bool: True if the action is allowed, False if the limit is exceeded.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            tokens = self.count_tokens(key, now)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self.buckets[key] = (tokens, now)
+
+        return allowed
+
+    def reserve(self, key) -> float:
+        """Take a token from the bucket of a key, even if the caller has to wait for it.
+
+        The bucket goes into debt if it is empty, so the callers are scheduled one after another at the refill rate.
+
+        Args:
+            key: The key to limit the actions of (e.g. a chat ID).
+
+        Returns:
+            float: The time (in seconds) to wait before the action, 0 if a token was available right away.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            tokens = self.count_tokens(key, now) - 1
+            self.buckets[key] = (tokens, now)
+
+        return max(0.0, -tokens / self.refill_rate)
+
+    def count_tokens(self, key, now: float) -> float:
+        """Count the tokens of a key after refilling its bucket (the lock has to be held by the caller).
+
+        Args:
+            key: The key of the bucket.
+            now (float): The current time (of time.monotonic).
+
+        Returns:
+            float: The tokens in the bucket (negative if reserve took tokens in advance).
+        """
+        if key in self.buckets:
+            tokens, last_time = self.buckets[key]
+            self.buckets.move_to_end(key)
+            return min(self.limit, tokens + (now - last_time) * self.refill_rate)
+
+        # Forget the least recently used bucket (which is most likely full again anyway)
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.popitem(last=False)
+        return self.limit
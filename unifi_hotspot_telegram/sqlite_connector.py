@@ -1,11 +1,130 @@
+import asyncio
+import functools
 import sqlite3
+import time
 
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from threading import local
 
+from unifi_hotspot_telegram.metrics import timed
+
+# The supported values of the journal_mode and synchronous pragmas
+JOURNAL_MODES = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+SYNCHRONOUS_SETTINGS = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
+# The value of the auto_vacuum pragma for incremental vacuuming
+AUTO_VACUUM_INCREMENTAL = 2
+
+# The time (in seconds) after which a pending confirmation counts as abandoned (e.g. the bot crashed while authorizing the guest)
+PENDING_CONFIRMATION_TIMEOUT = 300
+
+# The migrations to get from one schema version to the next one (the first entry migrates an empty database to version 1)
+SCHEMA_MIGRATIONS = [
+    # Version 1: The initial schema without any keys or indexes
+    [
+        "CREATE TABLE IF NOT EXISTS chats (chat_id TEXT)",
+        "CREATE TABLE IF NOT EXISTS requests (id TEXT, name TEXT, mac TEXT, sent INTEGER)",
+        "CREATE TABLE IF NOT EXISTS messages (id TEXT, chat_id TEXT, message_id TEXT)",
+        "CREATE TABLE IF NOT EXISTS confirmations (id TEXT , duration INTEGER, confirmator TEXT)",
+    ],
+    # Version 2: Primary keys, a unique chat_id and indexes for the frequent lookups
+    # (duplicates that were possible before are dropped, the oldest row is kept)
+    [
+        "CREATE TABLE chats_new (chat_id TEXT NOT NULL UNIQUE)",
+        "INSERT OR IGNORE INTO chats_new (chat_id) SELECT chat_id FROM chats WHERE chat_id IS NOT NULL ORDER BY rowid",
+        "DROP TABLE chats",
+        "ALTER TABLE chats_new RENAME TO chats",
+        "CREATE TABLE requests_new (id TEXT PRIMARY KEY, name TEXT, mac TEXT, sent INTEGER)",
+        "INSERT OR IGNORE INTO requests_new (id, name, mac, sent) SELECT id, name, mac, sent FROM requests ORDER BY rowid",
+        "DROP TABLE requests",
+        "ALTER TABLE requests_new RENAME TO requests",
+        "CREATE TABLE confirmations_new (id TEXT PRIMARY KEY, duration INTEGER, confirmator TEXT)",
+        "INSERT OR IGNORE INTO confirmations_new (id, duration, confirmator) SELECT id, duration, confirmator FROM confirmations ORDER BY rowid",
+        "DROP TABLE confirmations",
+        "ALTER TABLE confirmations_new RENAME TO confirmations",
+        "CREATE INDEX messages_id ON messages (id)",
+        "CREATE INDEX requests_open ON requests (id) WHERE sent = 0",
+    ],
+    # Version 3: Creation timestamps (in seconds since the epoch) for the retention policy
+    # (existing rows count as created at the time of the migration)
+    [
+        "ALTER TABLE requests ADD COLUMN created_at INTEGER",
+        "ALTER TABLE messages ADD COLUMN created_at INTEGER",
+        "ALTER TABLE confirmations ADD COLUMN created_at INTEGER",
+        "UPDATE requests SET created_at = CAST(strftime('%s', 'now') AS INTEGER)",
+        "UPDATE messages SET created_at = CAST(strftime('%s', 'now') AS INTEGER)",
+        "UPDATE confirmations SET created_at = CAST(strftime('%s', 'now') AS INTEGER)",
+        "CREATE INDEX confirmations_created_at ON confirmations (created_at)",
+    ],
+    # Version 4: Index to find the pending request of a device
+    [
+        "CREATE INDEX requests_mac ON requests (mac, created_at)",
+    ],
+    # Version 5: Leases of the bot workers on the open requests they are sending
+    [
+        "ALTER TABLE requests ADD COLUMN claimed_until INTEGER",
+    ],
+    # Version 6: Whether a message was changed to show the decision on its request (the messages of already
+    # decided requests were changed by the old versions)
+    [
+        "ALTER TABLE messages ADD COLUMN edited INTEGER NOT NULL DEFAULT 0",
+        "UPDATE messages SET edited = 1 WHERE id IN (SELECT id FROM confirmations)",
+    ],
+    # Version 7: The number of rounds in which a request couldn't be sent to all chats (requests are sent again to the
+    # chats that failed, but not forever)
+    [
+        "ALTER TABLE requests ADD COLUMN send_rounds INTEGER NOT NULL DEFAULT 0",
+    ],
+    # Version 8: Confirmations that are only final once the guest was authorized
+    [
+        "ALTER TABLE confirmations ADD COLUMN pending INTEGER NOT NULL DEFAULT 0",
+    ],
+    # Version 9: Requests whose buttons were sent with unsigned callback data by the old versions (only those
+    # accept it, and they are deleted with the retention policy)
+    [
+        "ALTER TABLE requests ADD COLUMN legacy_buttons INTEGER NOT NULL DEFAULT 0",
+        "UPDATE requests SET legacy_buttons = 1 WHERE sent = 1",
+    ],
+]
+
 
 class SQLiteConnector:
-    def __init__(self) -> None:
-        """Initialize the SQLiteConnector class."""
+    def __init__(
+        self,
+        database: str = "data.db",
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        busy_timeout: int = 5000,
+        cache_size: int = -2000,
+    ) -> None:
+        """Initialize the SQLiteConnector class.
+
+        Args:
+            database (str, optional): The path of the SQLite database file. Defaults to 'data.db'.
+            journal_mode (str, optional): The journal mode of the database. WAL allows the portal and the bot to read while the other one writes. Defaults to 'WAL'. Options are [DELETE|TRUNCATE|PERSIST|MEMORY|WAL|OFF]
+            synchronous (str, optional): How often SQLite waits for data to be written to disk. NORMAL only syncs on WAL checkpoints instead of on every commit. Defaults to 'NORMAL'. Options are [OFF|NORMAL|FULL|EXTRA]
+            busy_timeout (int, optional): The time (in milliseconds) to wait for a lock held by another connection before giving up. Defaults to 5000.
+            cache_size (int, optional): The size of the page cache per connection, in pages if positive or in KiB if negative (as in SQLite's cache_size pragma). Defaults to -2000.
+
+        Raises:
+            ValueError: If the journal mode or synchronous setting is not supported.
+        """
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError(
+                f"The journal mode {journal_mode} is not supported. Options are {JOURNAL_MODES}"
+            )
+        if synchronous.upper() not in SYNCHRONOUS_SETTINGS:
+            raise ValueError(
+                f"The synchronous setting {synchronous} is not supported. Options are {SYNCHRONOUS_SETTINGS}"
+            )
+
+        self.database = database
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous.upper()
+        self.busy_timeout = int(busy_timeout)
+        self.cache_size = int(cache_size)
+
         self.local_storage = local()
         self.create_tables()
 
@@ -15,19 +134,33 @@ class SQLiteConnector:
             self.local_storage.conn.close()
 
     def create_tables(self) -> None:
-        """Create the necessary tables if they don't exist."""
+        """Create the necessary tables if they don't exist and migrate them to the latest schema version.
+
+        The schema version of the database is stored in SQLite's user_version pragma. Every migration in
+        SCHEMA_MIGRATIONS that was not applied yet is run in a single transaction, so existing databases are upgraded in place.
+        """
         conn, cursor = self.get_conn()
-        cursor.execute("CREATE TABLE IF NOT EXISTS chats (chat_id TEXT)")
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS requests (id TEXT, name TEXT, mac TEXT, sent INTEGER)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS messages (id TEXT, chat_id TEXT, message_id TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS confirmations (id TEXT , duration INTEGER, confirmator TEXT)"
-        )
-        conn.commit()
+
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= len(SCHEMA_MIGRATIONS):
+            return
+
+        # Lock the database so the portal and the bot process don't migrate it at the same time
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Read the version again, the other process might have migrated the database in the meantime
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+
+            for new_version in range(version + 1, len(SCHEMA_MIGRATIONS) + 1):
+                for statement in SCHEMA_MIGRATIONS[new_version - 1]:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {new_version}")
+
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
 
     def get_conn(self) -> tuple:
         """Get the SQLite connection and cursor objects.
@@ -38,10 +171,75 @@ class SQLiteConnector:
                 The second element is the cursor object (`sqlite3.Cursor`).
         """
         if not hasattr(self.local_storage, "conn"):
-            self.local_storage.conn = sqlite3.connect("data.db")
+            self.local_storage.conn = sqlite3.connect(
+                self.database, timeout=self.busy_timeout / 1000
+            )
             self.local_storage.cursor = self.local_storage.conn.cursor()
+
+            # Free pages are only returned to the file system with auto_vacuum, which takes effect right away on a new
+            # database (so it has to come before the journal mode, which writes the file). Existing databases are
+            # converted by the first incremental_vacuum, as that takes a full VACUUM.
+            self.local_storage.cursor.execute(
+                f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}"
+            )
+
+            # Configure the connection (the values are validated in the constructor, as pragmas can't use parameters)
+            self.local_storage.cursor.execute(
+                f"PRAGMA journal_mode = {self.journal_mode}"
+            )
+            self.local_storage.cursor.execute(
+                f"PRAGMA synchronous = {self.synchronous}"
+            )
+            self.local_storage.cursor.execute(
+                f"PRAGMA busy_timeout = {self.busy_timeout}"
+            )
+            self.local_storage.cursor.execute(f"PRAGMA cache_size = {self.cache_size}")
         return self.local_storage.conn, self.local_storage.cursor
 
+    @contextmanager
+    def transaction(self):
+        """Run several statements in one transaction (committed at the end, rolled back on an exception).
+
+        The methods of the SQLiteConnector don't commit on their own while a transaction of their thread is open, so
+        `with db_connector.transaction(): ...` turns several calls into a single commit. Transactions can be nested,
+        only the outermost one commits.
+
+        Yields:
+            tuple: The SQLite connection and cursor objects (as returned by get_conn).
+        """
+        conn, cursor = self.get_conn()
+
+        # Nested transactions are part of the outer transaction
+        if getattr(self.local_storage, "transaction_depth", 0) > 0:
+            self.local_storage.transaction_depth += 1
+            try:
+                yield conn, cursor
+            finally:
+                self.local_storage.transaction_depth -= 1
+            return
+
+        # Take the write lock right away, so the transaction doesn't fail halfway because of the other process
+        cursor.execute("BEGIN IMMEDIATE")
+        self.local_storage.transaction_depth = 1
+        try:
+            yield conn, cursor
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            self.local_storage.transaction_depth = 0
+
+    def commit(self, conn: sqlite3.Connection) -> None:
+        """Commit the changes of a method, unless they are part of a transaction that is committed later.
+
+        Args:
+            conn (sqlite3.Connection): The connection of the current thread.
+        """
+        if getattr(self.local_storage, "transaction_depth", 0) == 0:
+            conn.commit()
+
+    @timed("sqlite_query_seconds", query="get_known_chats")
     def get_known_chats(self) -> list:
         """Get the list of known chats.
 
@@ -54,6 +252,7 @@ class SQLiteConnector:
         known_chats = [{"chat_id": row[0]} for row in known_chats]
         return known_chats
 
+    @timed("sqlite_query_seconds", query="get_messages")
     def get_messages(self, id: str) -> list:
         """Get the messages associated with a specific ID.
 
@@ -69,6 +268,34 @@ class SQLiteConnector:
         messages = [{"chat_id": row[0], "message_id": row[1]} for row in messages]
         return messages
 
+    @timed("sqlite_query_seconds", query="claim_unedited_messages")
+    def claim_unedited_messages(self, id: str) -> list:
+        """Get the messages of a request that weren't changed to show the decision yet and mark them as changed.
+
+        The messages are selected and marked in one transaction, so each message is only changed once, even if the
+        button handler and send_request of the telegram bot (or of two workers) try to change them at the same time.
+
+        Args:
+            id (str): The ID of the messages.
+
+        Returns:
+            list: A list of messages, each represented as a dictionary with 'chat_id' and 'message_id' keys.
+        """
+        with self.transaction() as (conn, cursor):
+            cursor.execute(
+                "SELECT chat_id, message_id FROM messages WHERE id = ? AND edited = 0",
+                (id,),
+            )
+            messages = [
+                {"chat_id": row[0], "message_id": row[1]} for row in cursor.fetchall()
+            ]
+            cursor.execute(
+                "UPDATE messages SET edited = 1 WHERE id = ? AND edited = 0", (id,)
+            )
+
+        return messages
+
+    @timed("sqlite_query_seconds", query="get_request")
     def get_request(self, id: str) -> dict:
         """Get a specific request by ID.
 
@@ -76,15 +303,23 @@ class SQLiteConnector:
             id (str): The ID of the request.
 
         Returns:
-            dict: A dictionary representing the request with 'name' and 'mac' keys, or None if the request is not found.
+            dict: A dictionary representing the request with 'name', 'mac' and 'legacy_buttons' (whether its buttons were
+                sent with unsigned callback data) keys, or None if the request is not found.
         """
         conn, cursor = self.get_conn()
-        cursor.execute("SELECT name, mac FROM requests WHERE id = ?", (id,))
+        cursor.execute(
+            "SELECT name, mac, legacy_buttons FROM requests WHERE id = ?", (id,)
+        )
         request = cursor.fetchone()
         if request is not None:
-            request = {"name": request[0], "mac": request[1]}
+            request = {
+                "name": request[0],
+                "mac": request[1],
+                "legacy_buttons": bool(request[2]),
+            }
         return request
 
+    @timed("sqlite_query_seconds", query="get_open_requests")
     def get_open_requests(self) -> list:
         """Get the open requests.
 
@@ -97,32 +332,145 @@ class SQLiteConnector:
         requests = [{"id": row[0], "name": row[1], "mac": row[2]} for row in requests]
         return requests
 
+    @timed("sqlite_query_seconds", query="claim_open_requests")
+    def claim_open_requests(self, limit: int, lease: int) -> list:
+        """Claim the oldest open requests that are not claimed by another worker (or whose claim expired).
+
+        The requests are selected and claimed in one transaction, so two workers (or two runs of the same worker)
+        never claim the same request. A claimed request is handed out again once its lease expires without being
+        marked as sent (e.g. because the worker crashed or postponed it), a worker that is still sending a request
+        renews its claim with extend_claims. Requests that were confirmed/denied in the meantime are not handed out
+        anymore.
+
+        Args:
+            limit (int): The maximum number of requests to claim.
+            lease (int): The time (in seconds) the requests are reserved for the caller.
+
+        Returns:
+            list: A list of the claimed requests, each represented as a dictionary with 'id', 'name', 'mac',
+                'send_rounds' (the number of earlier rounds in which the request couldn't be sent to all chats) and
+                'reclaimed' (whether the request was claimed before, so some chats might already have it) keys.
+        """
+        now = int(time.time())
+
+        with self.transaction() as (conn, cursor):
+            cursor.execute(
+                "SELECT id, name, mac, send_rounds, claimed_until IS NOT NULL FROM requests WHERE sent = 0 AND (claimed_until IS NULL OR claimed_until < ?) AND id NOT IN (SELECT id FROM confirmations) ORDER BY created_at LIMIT ?",
+                (now, limit),
+            )
+            requests = [
+                {
+                    "id": row[0],
+                    "name": row[1],
+                    "mac": row[2],
+                    "send_rounds": row[3],
+                    "reclaimed": bool(row[4]),
+                }
+                for row in cursor.fetchall()
+            ]
+            cursor.executemany(
+                "UPDATE requests SET claimed_until = ? WHERE id = ?",
+                [(now + lease, request["id"]) for request in requests],
+            )
+
+        return requests
+
+    @timed("sqlite_query_seconds", query="extend_claims")
+    def extend_claims(self, ids: list, lease: int) -> None:
+        """Renew the claims of requests that are still being sent (see claim_open_requests).
+
+        Args:
+            ids (list): The IDs of the claimed requests.
+            lease (int): The time (in seconds) the requests are reserved for the caller from now on.
+        """
+        if len(ids) == 0:
+            return
+
+        conn, cursor = self.get_conn()
+        placeholders = ", ".join("?" * len(ids))
+        cursor.execute(
+            f"UPDATE requests SET claimed_until = ? WHERE sent = 0 AND id IN ({placeholders})",
+            [int(time.time()) + lease, *ids],
+        )
+        self.commit(conn)
+
+    @timed("sqlite_query_seconds", query="get_pending_request_id")
+    def get_pending_request_id(self, mac: str, max_age: int) -> str:
+        """Get the ID of the latest request of a device that was not confirmed/denied yet.
+
+        Args:
+            mac (str): The MAC address of the device.
+            max_age (int): The maximum age (in seconds) of the request.
+
+        Returns:
+            str: The ID of the request, or None if there is no pending request.
+        """
+        conn, cursor = self.get_conn()
+        cursor.execute(
+            "SELECT id FROM requests WHERE mac = ? AND created_at >= ? AND id NOT IN (SELECT id FROM confirmations WHERE pending = 0) ORDER BY created_at DESC LIMIT 1",
+            (mac, int(time.time()) - max_age),
+        )
+        request = cursor.fetchone()
+        if request is not None:
+            request = request[0]
+        return request
+
+    @timed("sqlite_query_seconds", query="get_confirmation")
     def get_confirmation(self, unique_id: str) -> dict:
-        """Get the confirmation information for a specific unique ID.
+        """Get the confirmation information for a specific unique ID (pending confirmations are not returned).
 
         Args:
             unique_id (str): The unique ID.
 
         Returns:
-            dict: A dictionary representing the confirmation with 'duration' key, or None if the confirmation is not found.
+            dict: A dictionary representing the confirmation with 'duration' and 'confirmator' keys, or None if the confirmation is not found.
         """
         conn, cursor = self.get_conn()
-        cursor.execute("SELECT duration FROM confirmations WHERE id = ?", (unique_id,))
+        cursor.execute(
+            "SELECT duration, confirmator FROM confirmations WHERE id = ? AND pending = 0",
+            (unique_id,),
+        )
         confirmation = cursor.fetchone()
         if confirmation is not None:
-            confirmation = {"duration": confirmation[0]}
+            confirmation = {"duration": confirmation[0], "confirmator": confirmation[1]}
         return confirmation
 
+    @timed("sqlite_query_seconds", query="get_confirmations")
+    def get_confirmations(self, ids: list) -> dict:
+        """Get the confirmations of several requests with one query (pending confirmations are not returned).
+
+        Args:
+            ids (list): The IDs of the requests.
+
+        Returns:
+            dict: Maps the ID of each confirmed/denied request to a dictionary with 'duration' and 'confirmator' keys (as returned by get_confirmation).
+        """
+        if len(ids) == 0:
+            return {}
+
+        conn, cursor = self.get_conn()
+        placeholders = ", ".join("?" * len(ids))
+        cursor.execute(
+            f"SELECT id, duration, confirmator FROM confirmations WHERE id IN ({placeholders}) AND pending = 0",
+            ids,
+        )
+        return {
+            row[0]: {"duration": row[1], "confirmator": row[2]}
+            for row in cursor.fetchall()
+        }
+
+    @timed("sqlite_query_seconds", query="add_chat")
     def add_chat(self, chat_id: str) -> None:
-        """Add a chat ID to the database.
+        """Add a chat ID to the database (if it isn't already present).
 
         Args:
             chat_id (str): The chat ID to be added.
         """
         conn, cursor = self.get_conn()
-        cursor.execute("INSERT INTO chats (chat_id) VALUES (?)", (chat_id,))
-        conn.commit()
+        cursor.execute("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", (chat_id,))
+        self.commit(conn)
 
+    @timed("sqlite_query_seconds", query="add_request")
     def add_request(self, id: str, name: str, mac: str) -> None:
         """Add a request to the database.
 
@@ -136,26 +484,68 @@ class SQLiteConnector:
         # it might be good to perform some additional validation on the name before adding it to the database.
         conn, cursor = self.get_conn()
         cursor.execute(
-            "INSERT INTO requests (id, name, mac, sent) VALUES (?, ?, ?, 0)",
+            "INSERT INTO requests (id, name, mac, sent, created_at) VALUES (?, ?, ?, 0, CAST(strftime('%s', 'now') AS INTEGER))",
             (id, name, mac),
         )
-        conn.commit()
+        self.commit(conn)
 
-    def add_confirmation(self, id: str, duration: int, confirmator: str) -> None:
-        """Add a confirmation to the database.
+    @timed("sqlite_query_seconds", query="add_confirmation")
+    def add_confirmation(
+        self, id: str, duration: int, confirmator: str, pending: bool = False
+    ) -> bool:
+        """Add a confirmation to the database (if there isn't already a confirmation for the ID, the first one is kept).
+
+        A pending confirmation blocks other decisions on the request, but is only returned by get_confirmation once it
+        was finalized with finalize_confirmation. It can be taken back with remove_pending_confirmation, and is
+        replaced by the next decision if it is neither finalized nor removed within PENDING_CONFIRMATION_TIMEOUT.
 
         Args:
             id (str): The ID of the confirmation.
             duration (int): The duration the user is allowed to be connected (in minutes)
             confirmator (str): The telegram user that approved the request.
+            pending (bool, optional): Whether the confirmation still has to be finalized. Defaults to False.
+
+        Returns:
+            bool: True if the confirmation was added, False if the request was already confirmed/denied (or is being confirmed).
+        """
+        now = int(time.time())
+
+        with self.transaction() as (conn, cursor):
+            cursor.execute(
+                "DELETE FROM confirmations WHERE id = ? AND pending = 1 AND created_at < ?",
+                (id, now - PENDING_CONFIRMATION_TIMEOUT),
+            )
+            cursor.execute(
+                "INSERT OR IGNORE INTO confirmations (id, duration, confirmator, created_at, pending) VALUES (?, ?, ?, ?, ?)",
+                (id, duration, confirmator, now, int(pending)),
+            )
+            added = cursor.rowcount == 1
+
+        return added
+
+    @timed("sqlite_query_seconds", query="finalize_confirmation")
+    def finalize_confirmation(self, id: str) -> None:
+        """Make a pending confirmation final (see add_confirmation).
+
+        Args:
+            id (str): The ID of the confirmation.
         """
         conn, cursor = self.get_conn()
-        cursor.execute(
-            "INSERT INTO confirmations (id, duration, confirmator) VALUES (?, ?, ?)",
-            (id, duration, confirmator),
-        )
-        conn.commit()
+        cursor.execute("UPDATE confirmations SET pending = 0 WHERE id = ?", (id,))
+        self.commit(conn)
+
+    @timed("sqlite_query_seconds", query="remove_pending_confirmation")
+    def remove_pending_confirmation(self, id: str) -> None:
+        """Take back a pending confirmation (see add_confirmation), so the request can be confirmed/denied again.
+
+        Args:
+            id (str): The ID of the confirmation.
+        """
+        conn, cursor = self.get_conn()
+        cursor.execute("DELETE FROM confirmations WHERE id = ? AND pending = 1", (id,))
+        self.commit(conn)
 
+    @timed("sqlite_query_seconds", query="insert_message")
     def insert_message(self, id: str, chat_id: str, message_id: str) -> None:
         """Insert a message into the database.
 
@@ -166,11 +556,26 @@ class SQLiteConnector:
         """
         conn, cursor = self.get_conn()
         cursor.execute(
-            "INSERT INTO messages (id, chat_id, message_id) VALUES (?, ?, ?)",
+            "INSERT INTO messages (id, chat_id, message_id, created_at) VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))",
             (id, chat_id, message_id),
         )
-        conn.commit()
+        self.commit(conn)
 
+    @timed("sqlite_query_seconds", query="insert_messages")
+    def insert_messages(self, messages: list) -> None:
+        """Insert several messages into the database in one transaction.
+
+        Args:
+            messages (list): A list of messages, each represented as a tuple of ID, chat ID and message ID (as for insert_message).
+        """
+        conn, cursor = self.get_conn()
+        cursor.executemany(
+            "INSERT INTO messages (id, chat_id, message_id, created_at) VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))",
+            messages,
+        )
+        self.commit(conn)
+
+    @timed("sqlite_query_seconds", query="update_request_sent_status")
     def update_request_sent_status(self, id: str) -> None:
         """Update the sent status of a request to "sent"
 
@@ -179,4 +584,164 @@ class SQLiteConnector:
         """
         conn, cursor = self.get_conn()
         cursor.execute("UPDATE requests SET sent = 1 WHERE id = ?", (id,))
-        conn.commit()
+        self.commit(conn)
+
+    @timed("sqlite_query_seconds", query="update_requests_sent_status")
+    def update_requests_sent_status(self, ids: list) -> None:
+        """Update the sent status of several requests to "sent" in one transaction.
+
+        Args:
+            ids (list): The IDs of the requests.
+        """
+        conn, cursor = self.get_conn()
+        cursor.executemany(
+            "UPDATE requests SET sent = 1 WHERE id = ?", [(id,) for id in ids]
+        )
+        self.commit(conn)
+
+    @timed("sqlite_query_seconds", query="complete_sent_requests")
+    def complete_sent_requests(self, ids: list, messages: list) -> None:
+        """Mark claimed requests as sent and save their messages in one transaction.
+
+        Args:
+            ids (list): The IDs of the requests.
+            messages (list): The sent messages, each represented as a tuple of ID, chat ID and message ID (as for insert_message).
+        """
+        with self.transaction():
+            self.update_requests_sent_status(ids)
+            self.insert_messages(messages)
+
+    @timed("sqlite_query_seconds", query="postpone_requests")
+    def postpone_requests(self, ids: list, delay: int) -> None:
+        """Hand out claimed requests that couldn't be sent to all chats again after a delay and count the failed round.
+
+        Args:
+            ids (list): The IDs of the requests.
+            delay (int): The time (in seconds) until the requests can be claimed again.
+        """
+        conn, cursor = self.get_conn()
+        cursor.executemany(
+            "UPDATE requests SET claimed_until = ?, send_rounds = send_rounds + 1 WHERE id = ?",
+            [(int(time.time()) + delay, id) for id in ids],
+        )
+        self.commit(conn)
+
+    @timed("sqlite_query_seconds", query="save_send_results")
+    def save_send_results(
+        self, sent_ids: list, postponed_ids: list, messages: list, delay: int
+    ) -> None:
+        """Save the results of sending several claimed requests in one transaction.
+
+        Args:
+            sent_ids (list): The IDs of the requests that were sent to all chats (see complete_sent_requests).
+            postponed_ids (list): The IDs of the requests that have to be sent to some chats again (see postpone_requests).
+            messages (list): The sent messages of all requests, each represented as a tuple of ID, chat ID and message ID (as for insert_message).
+            delay (int): The time (in seconds) until the postponed requests can be claimed again.
+        """
+        with self.transaction():
+            self.complete_sent_requests(sent_ids, messages)
+            self.postpone_requests(postponed_ids, delay)
+
+    @timed("sqlite_query_seconds", query="purge_decided_requests")
+    def purge_decided_requests(self, max_age: int) -> int:
+        """Delete requests that were confirmed/denied a while ago, together with their messages and confirmations.
+
+        Requests nobody confirmed/denied (e.g. because the guest left) are deleted once they are older than max_age too.
+
+        Args:
+            max_age (int): The time (in seconds) after the decision (or, if there is none, after the request) until a request is deleted.
+
+        Returns:
+            int: The number of deleted requests.
+        """
+        cutoff = int(time.time()) - max_age
+
+        with self.transaction() as (conn, cursor):
+            cursor.execute(
+                "DELETE FROM messages WHERE id IN (SELECT id FROM confirmations WHERE created_at < ?)",
+                (cutoff,),
+            )
+            cursor.execute(
+                "DELETE FROM requests WHERE id IN (SELECT id FROM confirmations WHERE created_at < ?)",
+                (cutoff,),
+            )
+            deleted_requests = cursor.rowcount
+            cursor.execute("DELETE FROM confirmations WHERE created_at < ?", (cutoff,))
+
+            # Requests without a decision (the recently decided ones still have their confirmation at this point)
+            cursor.execute(
+                "DELETE FROM messages WHERE id IN (SELECT id FROM requests WHERE created_at < ? AND id NOT IN (SELECT id FROM confirmations))",
+                (cutoff,),
+            )
+            cursor.execute(
+                "DELETE FROM requests WHERE created_at < ? AND id NOT IN (SELECT id FROM confirmations)",
+                (cutoff,),
+            )
+            deleted_requests += cursor.rowcount
+
+        return deleted_requests
+
+    @timed("sqlite_query_seconds", query="incremental_vacuum")
+    def incremental_vacuum(self) -> None:
+        """Return the pages freed by deleted rows to the file system, so the database file shrinks again.
+
+        A database created without auto_vacuum is rebuilt by a full VACUUM once instead. Only the telegram bot calls
+        this method, so the portal and the bot never run a VACUUM at the same time.
+
+        Raises:
+            sqlite3.OperationalError: If the database is locked for longer than the busy timeout.
+        """
+        conn, cursor = self.get_conn()
+
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            # Turning on auto_vacuum for an existing database takes a full VACUUM (which shrinks the file as well)
+            cursor.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+            conn.executescript("VACUUM")
+            return
+
+        # The pragma frees one page per step, which only executescript runs to completion
+        conn.executescript("PRAGMA incremental_vacuum")
+
+
+class AsyncSQLiteConnector:
+    def __init__(self, db_connector: SQLiteConnector, max_workers: int = 4) -> None:
+        """Initialize the AsyncSQLiteConnector class.
+
+        The AsyncSQLiteConnector offers all methods of the given SQLiteConnector as coroutine functions
+        (e.g. `await async_db_connector.get_request(id)`), which run the blocking SQLite calls in a thread pool.
+        Each worker thread uses its own connection of the SQLiteConnector.
+
+        Args:
+            db_connector (SQLiteConnector): The connector to run the calls with.
+            max_workers (int, optional): The maximum number of SQLite calls running at the same time. Defaults to 4.
+        """
+        self.db_connector = db_connector
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sqlite"
+        )
+
+    def __del__(self) -> None:
+        """Stop the worker threads when the AsyncSQLiteConnector instance is deleted."""
+        self.executor.shutdown(wait=False)
+
+    def __getattr__(self, name: str):
+        """Get a method of the SQLiteConnector as coroutine function that runs in the thread pool.
+
+        Args:
+            name (str): The name of the method.
+
+        Returns:
+            The coroutine function.
+        """
+        method = getattr(self.db_connector, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def run_in_executor(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(method, *args, **kwargs)
+            )
+
+        return run_in_executor
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, without it the assets are only compressed with gzip
+    brotli = None
+
+# The media types that are worth compressing (the images are compressed already)
+COMPRESSIBLE_MIMETYPES = [
+    "application/javascript",
+    "image/svg+xml",
+    "text/css",
+    "text/javascript",
+    "text/markdown",
+    "text/plain",
+]
+
+# Cache-Control header of assets requested with their current content hash (the URL changes with the content)
+CACHE_CONTROL_VERSIONED = "public, max-age=31536000, immutable"
+
+# Cache-Control header of assets requested without (or with an outdated) content hash
+CACHE_CONTROL_UNVERSIONED = "no-cache"
+
+
+class StaticAsset:
+    def __init__(self, content: bytes, mimetype: str) -> None:
+        """Initialize the StaticAsset class and compress the content.
+
+        Args:
+            content (bytes): The content of the file.
+            mimetype (str): The media type of the file.
+        """
+        self.content = content
+        self.mimetype = mimetype
+        self.version = hashlib.sha256(content).hexdigest()[:16]
+
+        # The compressed variants of the content by content encoding, only if they are smaller
+        self.encodings = {}
+        if mimetype in COMPRESSIBLE_MIMETYPES:
+            if brotli is not None:
+                self.add_encoding("br", brotli.compress(content))
+            self.add_encoding("gzip", gzip.compress(content, mtime=0))
+
+    def add_encoding(self, encoding: str, compressed_content: bytes) -> None:
+        """Add a compressed variant of the content if it is smaller than the content.
+
+        Args:
+            encoding (str): The content encoding (e.g. 'gzip').
+            compressed_content (bytes): The compressed content.
+        """
+        if len(compressed_content) < len(self.content):
+            self.encodings[encoding] = compressed_content
+
+
+class StaticAssetManager:
+    def __init__(self, static_folder: str) -> None:
+        """Initialize the StaticAssetManager class and load all static files into memory.
+
+        Args:
+            static_folder (str): The folder containing the static files.
+        """
+        self.static_folder = static_folder
+        self.assets = self.load_assets()
+
+    def load_assets(self) -> dict:
+        """Load, hash and compress all files of the static folder.
+
+        Returns:
+            dict: A dictionary mapping the path of each file (relative to the static folder, with '/' as separator) to its StaticAsset.
+        """
+        assets = {}
+
+        for directory, _, filenames in os.walk(self.static_folder):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                with open(path, "rb") as file:
+                    content = file.read()
+
+                mimetype = mimetypes.guess_type(filename)[0]
+                if mimetype is None:
+                    mimetype = "application/octet-stream"
+
+                relative_path = os.path.relpath(path, self.static_folder)
+                assets[relative_path.replace(os.sep, "/")] = StaticAsset(
+                    content, mimetype
+                )
+
+        return assets
+
+    def add_version(self, endpoint: str, values: dict) -> None:
+        """Add the content hash of a static file to its URL (registered as URL defaults function of the Flask application).
+
+        Args:
+            endpoint (str): The endpoint the URL is built for.
+            values (dict): The values of the URL that is built.
+        """
+        if endpoint != "static" or "v" in values:
+            return
+
+        asset = self.assets.get(values.get("filename"))
+        if asset is not None:
+            values["v"] = asset.version
+
+    def serve(self, filename: str) -> Response:
+        """Serve a static file in the best encoding the client accepts.
+
+        Args:
+            filename (str): The path of the file relative to the static folder.
+
+        Returns:
+            flask.Response: The response with the (compressed) file, or 304 if the client's copy is still valid.
+        """
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+
+        encoding = None
+        for candidate in asset.encodings:
+            if request.accept_encodings[candidate] > 0:
+                encoding = candidate
+                break
+
+        if encoding is None:
+            response = Response(asset.content, mimetype=asset.mimetype)
+        else:
+            response = Response(asset.encodings[encoding], mimetype=asset.mimetype)
+            response.headers["Content-Encoding"] = encoding
+
+        response.headers["Vary"] = "Accept-Encoding"
+        response.set_etag(f"{asset.version}-{encoding or 'identity'}")
+
+        if request.args.get("v") == asset.version:
+            response.headers["Cache-Control"] = CACHE_CONTROL_VERSIONED
+        else:
+            response.headers["Cache-Control"] = CACHE_CONTROL_UNVERSIONED
+
+        return response.make_conditional(request)
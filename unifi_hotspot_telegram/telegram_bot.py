@@ -1,10 +1,18 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
 import logging
 import json
+import sqlite3
+import time
 import warnings
 
 from typing import List
 from telegram import __version__ as TG_VER
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, User
+from telegram.error import Forbidden, RetryAfter
 from telegram.ext import (
     Application,
     CallbackContext,
@@ -12,13 +20,38 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
 )
-from pyunifi.controller import Controller
 
-from unifi_hotspot_telegram.sqlite_connector import SQLiteConnector
+from unifi_hotspot_telegram.notifications import (
+    NotificationReceiver,
+    NotificationSender,
+)
+from unifi_hotspot_telegram.metrics import REGISTRY, timed
+from unifi_hotspot_telegram.rate_limiter import RateLimiter
+from unifi_hotspot_telegram.sqlite_connector import (
+    AsyncSQLiteConnector,
+    SQLiteConnector,
+)
 from unifi_hotspot_telegram.i18n_manager import I18nManager
 from unifi_hotspot_telegram.time_conversions import (
     convert_minutes_into_human_readable_string,
 )
+from unifi_hotspot_telegram.unifi_controller import UniFiControllerSession
+
+# The number of attempts for a Telegram Bot API call that is rejected because of a rate limit
+TELEGRAM_ATTEMPTS = 3
+
+# The number of times a request is sent to the chats it couldn't be sent to before the bot gives up
+MAX_SEND_ROUNDS = 5
+
+# The time (in seconds) to wait for further requests of a batch to be sent, so they are stored with the same commit
+# (a decision on a request that is not stored yet changes its messages once it is stored)
+STORE_INTERVAL = 1
+
+# The option index of the "deny" button in the callback data
+CALLBACK_DATA_DENY = 255
+
+# The length (in bytes) of the truncated HMAC that signs the callback data
+CALLBACK_DATA_TAG_LENGTH = 8
 
 
 class TelegramBot:
@@ -33,6 +66,21 @@ class TelegramBot:
         unifi_ssl_verify: bool = True,
         locale: str = "en",
         bot_accept_options: List[int] = [60, 1440, 4320, 10080],
+        notification_socket: str = "telegram_bot.sock",
+        check_requests_interval: int = 30,
+        portal_notification_socket: str = "guest_portal.sock",
+        db_connector: SQLiteConnector = None,
+        retention_days: int = 30,
+        retention_interval: int = 3600,
+        max_concurrent_sends: int = 8,
+        messages_per_second: int = 30,
+        chat_messages_per_minute: int = 20,
+        claim_batch_size: int = 100,
+        claim_lease: int = 300,
+        register_attempts: int = 5,
+        register_period: int = 900,
+        metrics_push_interval: int = 15,
+        telegram_base_url: str = "https://api.telegram.org/bot",
     ) -> None:
         """Initialize the TelegramBot class.
 
@@ -46,19 +94,86 @@ class TelegramBot:
             unifi_ssl_verify (bool, optional): Whether to verify the SSL certificate of the UniFi controller. Defaults to True.
             locale (str, optional): The locale to use for the telegram bot. Defaults to 'en'. Options are [de|en]
             bot_accept_options (List[int], optional): A list of options (in minutes) for the user to select from when accepting a request. Defaults to [60, 1440, 4320, 10080] (1 hour, 1 day, 3 days, 1 week)
+            notification_socket (str, optional): The path of the Unix socket the guest portal uses to notify the bot about new requests. Defaults to 'telegram_bot.sock'.
+            check_requests_interval (int, optional): The interval (in seconds) of the safety-net check for requests that were missed by the notifications. Defaults to 30.
+            portal_notification_socket (str, optional): The path of the Unix socket to notify the guest portal about confirmed/denied requests. Defaults to 'guest_portal.sock'.
+            db_connector (SQLiteConnector, optional): The connector to the database. Defaults to a connector with the default settings.
+            retention_days (int, optional): The number of days a request is kept in the database after it was confirmed/denied (or, if nobody did, after it was made). Defaults to 30. 0 keeps all requests forever.
+            retention_interval (int, optional): The interval (in seconds) in which old requests are deleted. Defaults to 3600.
+            max_concurrent_sends (int, optional): The maximum number of messages sent/edited at the same time. Defaults to 8.
+            messages_per_second (int, optional): The maximum number of messages sent/edited per second in all chats together (Telegram allows about 30). Defaults to 30. 0 disables the limit.
+            chat_messages_per_minute (int, optional): The maximum number of messages sent/edited per minute in one chat (Telegram allows 20 in groups). Defaults to 20. 0 disables the limit.
+            claim_batch_size (int, optional): The maximum number of open requests claimed (and sent) at once. Defaults to 100.
+            claim_lease (int, optional): The time (in seconds) after which a claimed request that was not sent is handed out again (e.g. to another worker if this one crashed), the claim is renewed while the request is still being sent. Defaults to 300.
+            register_attempts (int, optional): The maximum number of /register attempts per Telegram user within register_period. Defaults to 5. 0 disables the limit.
+            register_period (int, optional): The period (in seconds) in which the /register attempts of a Telegram user are refilled. Defaults to 900.
+            metrics_push_interval (int, optional): The interval (in seconds) in which the bot sends its metrics to the guest portal (which serves them on its metrics endpoint). Defaults to 15. 0 disables sending the metrics.
+            telegram_base_url (str, optional): The base URL of the Telegram Bot API (e.g. of a self-hosted Bot API server). Defaults to 'https://api.telegram.org/bot'.
         """
         self.bot_password = bot_password
         self.telegram_token = telegram_token
+        # The key to sign the callback data of the buttons with (derived from the token, so it is secret but stable across restarts)
+        self.callback_data_key = hmac.new(
+            telegram_token.encode(), b"callback_data", hashlib.sha256
+        ).digest()
         self.unifi_username = unifi_username
         self.unifi_password = unifi_password
         self.unifi_ip = unifi_ip
         self.unifi_api_version = unifi_api_version
         self.unifi_ssl_verify = unifi_ssl_verify
+        self.notification_socket = notification_socket
+        self.check_requests_interval = check_requests_interval
+        self.retention_days = retention_days
+        self.retention_interval = retention_interval
+        self.claim_batch_size = claim_batch_size
+        self.claim_lease = claim_lease
+        self.metrics_push_interval = metrics_push_interval
 
         self.i18n_manager = I18nManager(default_locale=locale)
         self.logger = logging.getLogger(__name__)
-        self.application = Application.builder().token(telegram_token).build()
-        self.db_connector = SQLiteConnector()
+        self.application = (
+            Application.builder()
+            .token(telegram_token)
+            .base_url(telegram_base_url)
+            .post_init(self.post_init)
+            .concurrent_updates(True)
+            .build()
+        )
+        self.db_connector = (
+            db_connector if db_connector is not None else SQLiteConnector()
+        )
+        # The handlers use the database via the async connector, so they don't block the event loop
+        self.async_db_connector = AsyncSQLiteConnector(self.db_connector)
+        self.unifi_session = UniFiControllerSession(
+            unifi_ip,
+            unifi_username,
+            unifi_password,
+            unifi_api_version=unifi_api_version,
+            unifi_ssl_verify=unifi_ssl_verify,
+        )
+        self.notification_receiver = None
+        self.known_chats = None  # set: The IDs (as strings) of the registered chats, loaded on first use
+        self.portal_notifier = NotificationSender(portal_notification_socket)
+
+        # Limit the number of parallel calls to the Telegram Bot API
+        self.telegram_semaphore = asyncio.Semaphore(max_concurrent_sends)
+
+        # Spread the messages of a burst of requests over time to stay within Telegram's rate limits (overall and per chat)
+        self.telegram_rate_limiter = (
+            RateLimiter(messages_per_second, 1) if messages_per_second > 0 else None
+        )
+        self.chat_rate_limiter = (
+            RateLimiter(chat_messages_per_minute, 60)
+            if chat_messages_per_minute > 0
+            else None
+        )
+
+        # Limit the /register attempts per Telegram user to slow down guessing the password
+        self.register_rate_limiter = (
+            RateLimiter(register_attempts, register_period)
+            if register_attempts > 0
+            else None
+        )
 
         valid_options = all(
             isinstance(opt, int) and opt > 0 for opt in bot_accept_options
@@ -71,6 +186,18 @@ class TelegramBot:
             )
             self.bot_accept_options = [60, 1440, 4320, 10080]
 
+        # The texts of the request messages and their keyboards only depend on the locale, so they are translated once
+        self.accept_option_labels = [
+            convert_minutes_into_human_readable_string(duration, self.i18n_manager)
+            for duration in self.bot_accept_options
+        ]
+        self.deny_option_label = self.i18n_manager.translate(
+            "telegram_bot.check_requests_deny_access"
+        )
+        self.confirm_access_text = self.i18n_manager.translate(
+            "telegram_bot.check_requests_confirm_access"
+        )
+
     def __del__(self) -> None:
         """Clean up resources when the TelegramBot instance is deleted."""
         del self.db_connector
@@ -85,14 +212,53 @@ class TelegramBot:
         # Add handler for inline keyboard buttons
         self.application.add_handler(CallbackQueryHandler(self.button))
 
-        # Add a command to check for incoming requests regularly (default interval is 2 seconds)
+        # Listen for notifications of the guest portal about new requests
+        try:
+            self.notification_receiver = NotificationReceiver(self.notification_socket)
+        except (AttributeError, OSError) as e:
+            warnings.warn(
+                f"Could not listen for notifications on {self.notification_socket} ({e}). New requests will only be picked up by the regular check."
+            )
+
+        # Check for incoming requests regularly as a safety net for missed notifications (default interval is 30 seconds)
         self.application.job_queue.run_repeating(
-            self.check_requests, interval=2, first=0
+            self.check_requests, interval=self.check_requests_interval, first=0
         )
 
+        # Delete old requests regularly so the database doesn't grow forever
+        if self.retention_days > 0:
+            self.application.job_queue.run_repeating(
+                self.purge_old_requests, interval=self.retention_interval, first=0
+            )
+
+        # Send the metrics to the guest portal regularly, so they are served together with the portal's metrics
+        if self.metrics_push_interval > 0:
+            self.application.job_queue.run_repeating(
+                self.push_metrics, interval=self.metrics_push_interval, first=0
+            )
+
         # Run the bot until the user presses Ctrl-C
         self.application.run_polling()
 
+    async def post_init(self, application: Application) -> None:
+        """Register the notification socket with the event loop once the application is initialized.
+
+        Args:
+            application (telegram.ext.Application): The application that was initialized.
+        """
+        if self.notification_receiver is not None:
+            asyncio.get_running_loop().add_reader(
+                self.notification_receiver.fileno(), self.handle_notifications
+            )
+
+    def handle_notifications(self) -> None:
+        """Handle pending notifications of the guest portal by checking for new requests immediately."""
+        notifications = self.notification_receiver.receive()
+
+        if any(topic == "new_request" for topic, _ in notifications):
+            self.application.job_queue.run_once(self.check_requests, 0)
+
+    @timed("bot_register_seconds")
     async def register(self, update: Update, context: CallbackContext) -> None:
         """Handle the register command.
 
@@ -100,6 +266,17 @@ class TelegramBot:
             update (telegram.Update): The update object.
             context (telegram.ext.CallbackContext): The callback context.
         """
+        # Check if the user has attempts left (before the database is touched)
+        user = update.effective_user
+        if self.register_rate_limiter is not None and user is not None:
+            if not self.register_rate_limiter.consume(user.id):
+                await update.message.reply_text(
+                    self.i18n_manager.translate(
+                        "telegram_bot.register_too_many_attempts"
+                    )
+                )
+                return
+
         # Check if a password was provided
         if len(context.args) == 0:
             await update.message.reply_text(
@@ -108,29 +285,29 @@ class TelegramBot:
             return
 
         password = context.args[0]
-        chat_id = update.message.chat.id
+        # The chat IDs are stored as text in the database
+        chat_id = str(update.message.chat.id)
 
         # Get all already registered chats
-        known_chats = self.db_connector.get_known_chats()
+        known_chats = await self.get_known_chat_ids()
 
         # If the chat is already registered, send a message
         if chat_id in known_chats:
-            update.message.reply_text(
+            await update.message.reply_text(
                 self.i18n_manager.translate("telegram_bot.register_already_registered")
             )
         else:
             # Else check if the password is correct
             if password == self.bot_password:
                 # If the password is correct, add the chat to the database
-                self.db_connector.add_chat(chat_id)
+                await self.async_db_connector.add_chat(chat_id)
+                known_chats.add(chat_id)
 
                 await update.message.reply_text(
                     self.i18n_manager.translate("telegram_bot.register_success")
                 )
             else:
-                # If the password is wrong, send a message
-                # WARNING: There is currently no protection against brute force attacks
-                # => If necessary it might be a good idea to limit the number of tries per telegram user
+                # If the password is wrong, send a message (the attempts per user are limited above)
                 await update.message.reply_text(
                     self.i18n_manager.translate("telegram_bot.register_wrong_password")
                 )
@@ -157,6 +334,7 @@ class TelegramBot:
             self.i18n_manager.translate("telegram_bot.help_tooltip")
         )
 
+    @timed("bot_button_seconds")
     async def button(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle the button callback query.
 
@@ -166,40 +344,83 @@ class TelegramBot:
         """
         query = update.callback_query
 
-        # CallbackQueries need to be answered
-        await query.answer()
-
-        # Get the data from the callback query
-        data = json.loads(query.data)
-        duration = data["duration"]
-        id = data["id"]
-
-        # Get the messages and the request from the database
-        messages = self.db_connector.get_messages(id)
-        request = self.db_connector.get_request(id)
+        # Get the data from the callback query and the request from the database (and ignore buttons that weren't
+        # created by this bot, unsigned callback data is only accepted for requests sent by older versions)
+        data = self.parse_callback_data(query.data)
+        request = None
+        if data is not None:
+            id, duration, signed = data
+            request = await self.async_db_connector.get_request(id)
+        if request is None or not (signed or request["legacy_buttons"]):
+            self.logger.warning(f"Ignoring invalid callback data: {query.data}")
+            REGISTRY.increment("bot_decisions_total", decision="invalid")
+            await query.answer()
+            return
         name = request["name"]
         mac = request["mac"]
 
         # Get the the person who confirmed/denied the request
         confirmator = self.get_confirmator(query.from_user)
 
-        # Add the confirmation to the database
-        self.db_connector.add_confirmation(id, duration, confirmator)
-
-        # Create the pyunifi controller instance
-        # (We create the instance here and not in the constructor, because pyunifi seems to tend to lose the login after a while.)
-        controller = Controller(
-            self.unifi_ip,
-            self.unifi_username,
-            self.unifi_password,
-            version=self.unifi_api_version,
-            ssl_verify=self.unifi_ssl_verify,
+        # Add the confirmation to the database (only the first decision on a request counts). It stays pending until
+        # the guest was authorized, so the guest's page doesn't show it before and it can be taken back on a failure.
+        if not await self.async_db_connector.add_confirmation(
+            id, duration, confirmator, pending=True
+        ):
+            # Another admin was faster, so the guest was (or is being) authorized and the messages are changed by them
+            REGISTRY.increment("bot_decisions_total", decision="duplicate")
+            await query.answer(
+                self.i18n_manager.translate("telegram_bot.button_already_handled")
+            )
+            return
+
+        # Authorize the guest (the session logs in again if pyunifi lost the login in the meantime)
+        try:
+            await self.unifi_session.authorize_guest(mac, duration)
+        except Exception as e:
+            # Take the decision back, so the request can be confirmed/denied again once the controller is reachable
+            self.logger.warning(f"Could not authorize {mac} for request {id}: {e}")
+            await self.async_db_connector.remove_pending_confirmation(id)
+            REGISTRY.increment("bot_decisions_total", decision="failed")
+            await query.answer(
+                self.i18n_manager.translate("telegram_bot.button_authorization_failed")
+            )
+            return
+
+        await self.async_db_connector.finalize_confirmation(id)
+        REGISTRY.increment(
+            "bot_decisions_total", decision="accepted" if duration > 0 else "denied"
+        )
+
+        # CallbackQueries need to be answered
+        await query.answer()
+
+        # Wake up the guest's waiting page (if this fails, the page notices the confirmation with a delay)
+        self.portal_notifier.notify("confirmation", id)
+
+        # Change the request messages in all chats it was sent to (to avoid the request being confirmed/denied multiple times).
+        # Messages whose ids are not stored yet are changed by send_request, which checks for a decision after storing them.
+        messages = await self.async_db_connector.claim_unedited_messages(id)
+        await self.edit_request_messages(
+            context,
+            messages,
+            self.build_decision_text(name, mac, duration, confirmator),
         )
 
-        # Authorize the guest
-        controller.authorize_guest(mac, duration)
+    def build_decision_text(
+        self, name: str, mac: str, duration: int, confirmator: str
+    ) -> str:
+        """Compile the text of a request message after the request was confirmed/denied.
 
-        # Compile the text to change the telegram messages to (to avoid the request being confirmed/denied multiple times)
+        Args:
+            name (str): The name of the guest.
+            mac (str): The MAC address of the guest.
+            duration (int): The duration (in minutes) the guest was granted access for, -1 if the request was denied.
+            confirmator (str): The telegram user that confirmed/denied the request.
+
+        Returns:
+            str: The text of the message.
+        """
         text = self.i18n_manager.translate(
             "telegram_bot.button_and_check_requests_access_requested",
             name=name,
@@ -207,9 +428,9 @@ class TelegramBot:
         )
         text += "\n\n"
 
-        if int(duration) > 0:
+        if duration > 0:
             human_readable_duration = convert_minutes_into_human_readable_string(
-                int(duration), self.i18n_manager
+                duration, self.i18n_manager
             )
 
             text += self.i18n_manager.translate(
@@ -222,78 +443,398 @@ class TelegramBot:
                 "telegram_bot.button_access_denied", confirmator=confirmator
             )
 
-        # Change the request messages in all chats it was sent to
-        for message in messages:
-            await context.bot.edit_message_text(
-                text, message["chat_id"], message["message_id"]
-            )
+        return text
 
-    async def check_requests(self, context: CallbackContext) -> None:
-        """Check for incoming requests.
+    async def edit_request_messages(
+        self, context: CallbackContext, messages: list, text: str
+    ) -> None:
+        """Change the text of request messages in all chats at the same time (which also removes their keyboards).
 
         Args:
             context (telegram.ext.CallbackContext): The callback context.
+            messages (list): The messages, each represented as a dictionary with 'chat_id' and 'message_id' keys (as returned by SQLiteConnector.get_messages).
+            text (str): The new text of the messages.
         """
-        # Get all open requests (= requests that were not sent to the telegram chats yet)
-        open_requests = self.db_connector.get_open_requests()
+        results = await asyncio.gather(
+            *[
+                self.call_telegram(
+                    context.bot.edit_message_text,
+                    text=text,
+                    chat_id=message["chat_id"],
+                    message_id=message["message_id"],
+                )
+                for message in messages
+            ],
+            return_exceptions=True,
+        )
 
-        # For each open request ...
-        for request in open_requests:
-            id = request["id"]
-            name = request["name"]
-            mac = request["mac"]
+        for message, result in zip(messages, results):
+            if isinstance(result, Exception):
+                self.logger.warning(
+                    f"Could not edit message {message['message_id']} in chat {message['chat_id']}: {result}"
+                )
 
-            self.db_connector.update_request_sent_status(id)
+    @timed("bot_check_requests_seconds")
+    async def check_requests(self, context: CallbackContext) -> None:
+        """Check for incoming requests.
+
+        Args:
+            context (telegram.ext.CallbackContext): The callback context.
+        """
+        # Runs triggered by notifications and the safety-net check at the same time (or by other workers) claim
+        # different requests, so they don't need to wait for each other
+        await self.send_open_requests(context)
 
-            # ... send  a query to all registered chats
-            known_chats = self.db_connector.get_known_chats()
+    async def send_open_requests(self, context: CallbackContext) -> None:
+        """Send all open requests to the registered chats.
 
-            for known_chat in known_chats:
-                chat_id = known_chat["chat_id"]
-                keyboard = []
+        Args:
+            context (telegram.ext.CallbackContext): The callback context.
+        """
+        while True:
+            # Claim the open requests (= requests that were not sent to the telegram chats yet), so no other worker sends them too
+            open_requests = await self.async_db_connector.claim_open_requests(
+                self.claim_batch_size, self.claim_lease
+            )
+            if len(open_requests) == 0:
+                return
+            REGISTRY.increment("bot_requests_sent_total", len(open_requests))
+
+            # Other workers might have registered chats in the meantime
+            await self.get_known_chat_ids(reload=True)
+
+            # Send all claimed requests at the same time (call_telegram limits the number of parallel messages)
+            request_ids = {
+                asyncio.create_task(self.send_request(context, request)): request["id"]
+                for request in open_requests
+            }
+            sends = set(request_ids)
+            renew_claims_at = time.monotonic() + self.claim_lease / 3
+            while sends:
+                finished, sends = await asyncio.wait(
+                    sends,
+                    timeout=max(renew_claims_at - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
 
-                # Add the different "accept" options
-                keyboard_accept_options = []
-                for duration in self.bot_accept_options:
-                    duration_str = convert_minutes_into_human_readable_string(
-                        duration, self.i18n_manager
+                # The rate limits can delay a large batch for longer than the lease, so the requests that are still
+                # being sent are claimed again in time (otherwise another run would claim and announce them again)
+                if time.monotonic() >= renew_claims_at and sends:
+                    await self.async_db_connector.extend_claims(
+                        [request_ids[send] for send in sends], self.claim_lease
                     )
-                    button = InlineKeyboardButton(
-                        duration_str,
-                        callback_data=json.dumps({"duration": str(duration), "id": id}),
+                    renew_claims_at = time.monotonic() + self.claim_lease / 3
+                if not finished:
+                    continue
+
+                # Store the requests as soon as they were sent (so a decision can change their messages right away),
+                # but together with the ones finishing shortly after, so a burst only takes a handful of commits
+                if sends:
+                    more_finished, sends = await asyncio.wait(
+                        sends, timeout=STORE_INTERVAL
                     )
-                    keyboard_accept_options.append(button)
-                keyboard.append(keyboard_accept_options)
-
-                # Add "deny" option
-                deny_button = InlineKeyboardButton(
-                    self.i18n_manager.translate(
-                        "telegram_bot.check_requests_deny_access"
-                    ),
-                    callback_data=json.dumps({"duration": "-1", "id": id}),
+                    finished |= more_finished
+                await self.store_sent_requests(
+                    context, [send.result() for send in finished]
                 )
-                keyboard.append([deny_button])
 
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            # Claim the next batch only if there might be more open requests
+            if len(open_requests) < self.claim_batch_size:
+                return
+
+    async def send_request(self, context: CallbackContext, request: dict) -> dict:
+        """Send a request to all registered chats (the results are stored by store_sent_requests).
 
-                message = self.i18n_manager.translate(
-                    "telegram_bot.button_and_check_requests_access_requested",
-                    name=name,
-                    mac=mac,
+        Args:
+            context (telegram.ext.CallbackContext): The callback context.
+            request (dict): The request as returned by SQLiteConnector.claim_open_requests.
+
+        Returns:
+            dict: The result with 'request' (the given request), 'messages' (the sent messages, each represented as a tuple
+                of request ID, chat ID and message ID as for SQLiteConnector.insert_messages) and 'failed_chats' (the
+                number of chats the request has to be sent to again) keys.
+        """
+        id = request["id"]
+        name = request["name"]
+        mac = request["mac"]
+
+        # The message and the keyboard are the same for all chats
+        message = self.i18n_manager.translate(
+            "telegram_bot.button_and_check_requests_access_requested",
+            name=name,
+            mac=mac,
+        )
+        message += "\n\n"
+        message += self.confirm_access_text
+
+        reply_markup = self.build_reply_markup(id)
+
+        # Send a query to all registered chats (that didn't get the request in an earlier round)
+        chat_ids = await self.get_known_chat_ids()
+        if request["reclaimed"]:
+            sent_messages = await self.async_db_connector.get_messages(id)
+            chat_ids = chat_ids - {message["chat_id"] for message in sent_messages}
+        chat_ids = list(chat_ids)
+        sends = [
+            self.call_telegram(
+                context.bot.send_message,
+                chat_id=chat_id,
+                text=message,
+                reply_markup=reply_markup,
+            )
+            for chat_id in chat_ids
+        ]
+
+        results = await asyncio.gather(*sends, return_exceptions=True)
+
+        messages = []
+        failed_chats = 0
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Forbidden):
+                # The bot was blocked or removed from the chat (the chat stays registered, an admin has to fix this)
+                self.logger.warning(
+                    f"Could not send request {id} to chat {chat_id}, the bot is not allowed to write to it: {result}"
                 )
-                message += "\n\n"
-                message += self.i18n_manager.translate(
-                    "telegram_bot.check_requests_confirm_access"
+                REGISTRY.increment("bot_message_errors_total", reason="forbidden")
+            elif isinstance(result, Exception):
+                self.logger.warning(
+                    f"Could not send request {id} to chat {chat_id}: {result}"
                 )
+                REGISTRY.increment("bot_message_errors_total", reason="other")
+                failed_chats += 1
+            else:
+                messages.append((id, chat_id, result.message_id))
 
-                # Send the message and save the message id in the database (to be able to change the message later once the request was confirmed/denied)
-                message_object = await context.bot.send_message(
-                    chat_id=chat_id, text=message, reply_markup=reply_markup
-                )
+        REGISTRY.increment("bot_messages_sent_total", len(messages))
+
+        return {"request": request, "messages": messages, "failed_chats": failed_chats}
 
-                message_id = message_object.message_id
+    async def store_sent_requests(
+        self, context: CallbackContext, results: list
+    ) -> None:
+        """Mark sent requests as sent and save their message ids with one commit.
+
+        If a request couldn't be sent to some chats (for another reason than the bot not being allowed to write to
+        them), it is claimed again after check_requests_interval and only sent to the remaining chats (at most
+        MAX_SEND_ROUNDS times).
 
-                self.db_connector.insert_message(id, chat_id, message_id)
+        Args:
+            context (telegram.ext.CallbackContext): The callback context.
+            results (list): The results of send_request.
+        """
+        sent_ids, postponed_ids, messages = [], [], []
+        for result in results:
+            request = result["request"]
+            messages += result["messages"]
+
+            if (
+                result["failed_chats"] > 0
+                and request["send_rounds"] + 1 < MAX_SEND_ROUNDS
+            ):
+                # Try the failed chats again later
+                postponed_ids.append(request["id"])
+            else:
+                if result["failed_chats"] > 0:
+                    self.logger.warning(
+                        f"Giving up sending request {request['id']} to {result['failed_chats']} chats after {MAX_SEND_ROUNDS} attempts."
+                    )
+                sent_ids.append(request["id"])
+
+        # Mark the requests as sent and save the message ids (to be able to change the messages later once the request was confirmed/denied) with a single commit
+        await self.async_db_connector.save_send_results(
+            sent_ids, postponed_ids, messages, self.check_requests_interval
+        )
+
+        # An admin might have decided on a request before the message ids were stored (e.g. in a chat that got the
+        # message early), then the button handler didn't see all messages and the remaining ones are changed here
+        confirmations = await self.async_db_connector.get_confirmations(
+            [result["request"]["id"] for result in results if result["messages"]]
+        )
+        for result in results:
+            request = result["request"]
+            confirmation = confirmations.get(request["id"])
+            if confirmation is None:
+                continue
+
+            await self.edit_request_messages(
+                context,
+                await self.async_db_connector.claim_unedited_messages(request["id"]),
+                self.build_decision_text(
+                    request["name"],
+                    request["mac"],
+                    confirmation["duration"],
+                    confirmation["confirmator"],
+                ),
+            )
+
+    async def get_known_chat_ids(self, reload: bool = False) -> set:
+        """Get the IDs of the registered chats (only the first call reads them from the database, unless reload is set).
+
+        The set is kept up to date by register of this worker. Chats registered by other workers are picked up by
+        send_open_requests, which reloads the set for every batch of claimed requests.
+
+        Args:
+            reload (bool, optional): Whether to read the chats from the database again. Defaults to False.
+
+        Returns:
+            set: The IDs of the registered chats as strings.
+        """
+        if self.known_chats is None or reload:
+            known_chats = await self.async_db_connector.get_known_chats()
+            self.known_chats = {known_chat["chat_id"] for known_chat in known_chats}
+
+        return self.known_chats
+
+    def build_reply_markup(self, id: str) -> InlineKeyboardMarkup:
+        """Build the keyboard to confirm/deny a request from the pre-translated labels.
+
+        Args:
+            id (str): The ID of the request.
+
+        Returns:
+            telegram.InlineKeyboardMarkup: The keyboard with the "accept" options in the first row and the "deny" option in the second row.
+        """
+        keyboard_accept_options = [
+            InlineKeyboardButton(
+                label, callback_data=self.build_callback_data(id, index)
+            )
+            for index, label in enumerate(self.accept_option_labels)
+        ]
+        deny_button = InlineKeyboardButton(
+            self.deny_option_label,
+            callback_data=self.build_callback_data(id, CALLBACK_DATA_DENY),
+        )
+
+        return InlineKeyboardMarkup([keyboard_accept_options, [deny_button]])
+
+    def build_callback_data(self, id: str, option_index: int) -> str:
+        """Pack the request ID and the selected option into signed callback data.
+
+        The callback data is the request ID (16 bytes), the option index (1 byte) and a truncated HMAC of both, encoded
+        as URL-safe base64 (34 characters, well within Telegram's limit of 64 bytes).
+
+        Args:
+            id (str): The ID of the request (the hex representation of a UUID).
+            option_index (int): The index of the duration in bot_accept_options or CALLBACK_DATA_DENY.
+
+        Returns:
+            str: The callback data.
+        """
+        payload = bytes.fromhex(id) + bytes([option_index])
+        tag = hmac.new(self.callback_data_key, payload, hashlib.sha256).digest()
+        return (
+            base64.urlsafe_b64encode(payload + tag[:CALLBACK_DATA_TAG_LENGTH])
+            .rstrip(b"=")
+            .decode()
+        )
+
+    def parse_callback_data(self, data: str) -> tuple:
+        """Unpack and verify the callback data of a button.
+
+        The JSON callback data of the buttons sent by older versions is unpacked too, as long as its duration is one
+        of the current options. It isn't signed, so the caller has to check that the request was sent by an older version.
+
+        Args:
+            data (str): The callback data.
+
+        Returns:
+            tuple: The ID of the request, the selected duration (in minutes, -1 for "deny") and whether the callback data
+                was signed, or None if the callback data is invalid or its signature doesn't match.
+        """
+        if data.startswith("{"):
+            try:
+                legacy_data = json.loads(data)
+                duration = int(legacy_data["duration"])
+                id = legacy_data["id"]
+            except (ValueError, KeyError, TypeError):
+                return None
+
+            if duration != -1 and duration not in self.bot_accept_options:
+                return None
+            return str(id), duration, False
+
+        try:
+            # Restore the padding that was stripped when the callback data was built
+            raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+        except (ValueError, binascii.Error):
+            return None
+
+        payload, tag = raw[:-CALLBACK_DATA_TAG_LENGTH], raw[-CALLBACK_DATA_TAG_LENGTH:]
+        if len(payload) != 17:
+            return None
+
+        expected_tag = hmac.new(
+            self.callback_data_key, payload, hashlib.sha256
+        ).digest()
+        if not hmac.compare_digest(tag, expected_tag[:CALLBACK_DATA_TAG_LENGTH]):
+            return None
+
+        id, option_index = payload[:16].hex(), payload[16]
+        if option_index == CALLBACK_DATA_DENY:
+            return id, -1, True
+        if option_index >= len(self.bot_accept_options):
+            return None
+        return id, self.bot_accept_options[option_index], True
+
+    async def call_telegram(self, function, *args, **kwargs):
+        """Call a method of the Telegram Bot API, limiting the number of parallel calls and the calls per second and waiting if Telegram asks for it.
+
+        Args:
+            function: The coroutine function to call (e.g. context.bot.send_message).
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function (the limit per chat applies if chat_id is one of them).
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            telegram.error.RetryAfter: If Telegram still asks to wait after several attempts.
+        """
+        chat_id = kwargs.get("chat_id")
+
+        for attempt in range(TELEGRAM_ATTEMPTS):
+            # Wait for the turn of the chat first and then for the overall turn (so the overall turn isn't taken too early)
+            if self.chat_rate_limiter is not None and chat_id is not None:
+                await asyncio.sleep(self.chat_rate_limiter.reserve(chat_id))
+            if self.telegram_rate_limiter is not None:
+                await asyncio.sleep(self.telegram_rate_limiter.reserve(None))
+
+            async with self.telegram_semaphore:
+                try:
+                    return await function(*args, **kwargs)
+                except RetryAfter as e:
+                    if attempt == TELEGRAM_ATTEMPTS - 1:
+                        raise
+                    retry_after = e.retry_after
+
+            # Wait outside of the semaphore, so the slot can be used in the meantime
+            await asyncio.sleep(retry_after)
+
+    async def purge_old_requests(self, context: CallbackContext) -> None:
+        """Delete requests that were confirmed/denied (or made without a decision) longer ago than the retention period and shrink the database.
+
+        Args:
+            context (telegram.ext.CallbackContext): The callback context.
+        """
+        deleted_requests = await self.async_db_connector.purge_decided_requests(
+            self.retention_days * 24 * 60 * 60
+        )
+
+        if deleted_requests > 0:
+            self.logger.info(f"Deleted {deleted_requests} old requests.")
+            try:
+                await self.async_db_connector.incremental_vacuum()
+            except sqlite3.OperationalError as e:
+                # The portal held a lock for too long, the freed pages are returned by the next run
+                self.logger.warning(f"Could not shrink the database: {e}")
+
+    async def push_metrics(self, context: CallbackContext) -> None:
+        """Send a snapshot of the bot's metrics to the guest portal.
+
+        Args:
+            context (telegram.ext.CallbackContext): The callback context.
+        """
+        self.portal_notifier.notify("metrics", json.dumps(REGISTRY.snapshot()))
 
     def get_confirmator(self, user: User) -> str:
         """Combine the user's name, last name and username to a string.
@@ -1,11 +1,28 @@
+import functools
+
 from unifi_hotspot_telegram.i18n_manager import I18nManager
 
+# The time units from the largest to the smallest: The translation key, the number of minutes of the next larger unit
+# (the remainder of which is split up) and the number of minutes per unit
+TIME_UNITS = [
+    ("time_conversions.year", None, 60 * 24 * 365),
+    ("time_conversions.month", 60 * 24 * 365, 60 * 24 * 30),
+    ("time_conversions.week", 60 * 24 * 30, 60 * 24 * 7),
+    ("time_conversions.day", 60 * 24 * 7, 60 * 24),
+    ("time_conversions.hour", 60 * 24, 60),
+    ("time_conversions.minute", 60, 1),
+]
+
 
+@functools.lru_cache(maxsize=4096)
 def convert_minutes_into_human_readable_string(
     minutes: int, i18n_manager: I18nManager
 ) -> str:
     """Convert minutes into a human-readable string.
 
+    The result is cached per number of minutes and I18nManager (I18nManagers sharing their translations and locale
+    are equal), as the same few durations are converted over and over again.
+
     Args:
         minutes (int): The number of minutes to convert.
         i18n_manager (I18nManager): The I18nManager instance for translation of the time units.
@@ -17,55 +34,15 @@ def convert_minutes_into_human_readable_string(
         ValueError: If minutes is not greater than 0.
     """
     if minutes > 0:
-        # Compute the number of years, months, weeks, days, hours, and minutes
-        years = minutes // (60 * 24 * 365)
-        months = (minutes % (60 * 24 * 365)) // (60 * 24 * 30)
-        weeks = (minutes % (60 * 24 * 30)) // (60 * 24 * 7)
-        days = (minutes % (60 * 24 * 7)) // (60 * 24)
-        hours = (minutes % (60 * 24)) // 60
-        extra_minutes = minutes % 60
+        # Compute the count of each unit (of the remainder of the next larger unit) and translate the units that occur
+        parts = []
+        for key, modulus, unit_minutes in TIME_UNITS:
+            remainder = minutes if modulus is None else minutes % modulus
+            count = remainder // unit_minutes
+            if count > 0:
+                parts.append(i18n_manager.translate(key, count=count))
 
         # Build the human-readable string
-        human_readable = ""
-
-        if years > 0:
-            human_readable += i18n_manager.translate(
-                "time_conversions.year", count=years
-            )
-
-        if months > 0:
-            if human_readable != "":
-                human_readable += " "
-            human_readable += i18n_manager.translate(
-                "time_conversions.month", count=months
-            )
-
-        if weeks > 0:
-            if human_readable != "":
-                human_readable += " "
-            human_readable += i18n_manager.translate(
-                "time_conversions.week", count=weeks
-            )
-
-        if days > 0:
-            if human_readable != "":
-                human_readable += " "
-            human_readable += i18n_manager.translate("time_conversions.day", count=days)
-
-        if hours > 0:
-            if human_readable != "":
-                human_readable += " "
-            human_readable += i18n_manager.translate(
-                "time_conversions.hour", count=hours
-            )
-
-        if extra_minutes > 0:
-            if human_readable != "":
-                human_readable += " "
-            human_readable += i18n_manager.translate(
-                "time_conversions.minute", count=extra_minutes
-            )
-
-        return human_readable
+        return " ".join(parts)
     else:
         raise ValueError("Minutes must be greater than 0")
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from pyunifi.controller import APIError, Controller
+
+from unifi_hotspot_telegram.metrics import REGISTRY
+
+
+class UniFiControllerSession:
+    def __init__(
+        self,
+        unifi_ip: str,
+        unifi_username: str,
+        unifi_password: str,
+        unifi_api_version: str = "UDMP-unifiOS",
+        unifi_ssl_verify: bool = True,
+        max_workers: int = 4,
+    ) -> None:
+        """Initialize the UniFiControllerSession class.
+
+        The session keeps one logged in pyunifi controller and only logs in again if a call fails,
+        instead of logging in for every call.
+
+        Args:
+            unifi_ip (str): The IP address of the UniFi controller.
+            unifi_username (str): The username for the UniFi controller.
+            unifi_password (str): The password for the UniFi controller.
+            unifi_api_version (str, optional): The API version of the UniFi controller. Defaults to "UDMP-unifiOS". Options are [v4|v5|unifiOS|UDMP-unifiOS] (as described in https://github.com/finish06/pyunifi)
+            unifi_ssl_verify (bool, optional): Whether to verify the SSL certificate of the UniFi controller. Defaults to True.
+            max_workers (int, optional): The maximum number of pyunifi calls running at the same time. Defaults to 4.
+        """
+        self.unifi_ip = unifi_ip
+        self.unifi_username = unifi_username
+        self.unifi_password = unifi_password
+        self.unifi_api_version = unifi_api_version
+        self.unifi_ssl_verify = unifi_ssl_verify
+
+        self.logger = logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="unifi"
+        )
+        self.controller = None
+        self.lock = Lock()
+
+    def __del__(self) -> None:
+        """Stop the worker threads when the UniFiControllerSession instance is deleted."""
+        self.executor.shutdown(wait=False)
+
+    def get_controller(self) -> Controller:
+        """Get the logged in controller, logging in if there is none yet.
+
+        Returns:
+            pyunifi.controller.Controller: The logged in controller.
+        """
+        with self.lock:
+            if self.controller is None:
+                # Creating the controller logs in
+                self.controller = Controller(
+                    self.unifi_ip,
+                    self.unifi_username,
+                    self.unifi_password,
+                    version=self.unifi_api_version,
+                    ssl_verify=self.unifi_ssl_verify,
+                )
+            return self.controller
+
+    def discard_controller(self, controller: Controller) -> None:
+        """Discard a controller whose login doesn't work anymore, so the next call logs in again.
+
+        Args:
+            controller (pyunifi.controller.Controller): The controller to discard.
+        """
+        with self.lock:
+            # Another thread might already have replaced the controller
+            if self.controller is controller:
+                self.controller = None
+
+    def call(self, method: str, *args, **kwargs):
+        """Call a method of the controller (blocking), logging in again once if the call fails.
+
+        Args:
+            method (str): The name of the pyunifi controller method.
+            *args: The positional arguments of the method.
+            **kwargs: The keyword arguments of the method.
+
+        Returns:
+            The return value of the method.
+
+        Raises:
+            pyunifi.controller.APIError: If the call fails with a fresh login too.
+        """
+        with REGISTRY.timer("unifi_call_seconds", method=method):
+            controller = self.get_controller()
+
+            try:
+                return getattr(controller, method)(*args, **kwargs)
+            except APIError as e:
+                # pyunifi already retries with a new login on the same controller, so start over with a new one
+                self.logger.warning(
+                    f"UniFi call {method} failed ({e}), logging in again."
+                )
+                REGISTRY.increment("unifi_call_retries_total", method=method)
+                self.discard_controller(controller)
+
+            return getattr(self.get_controller(), method)(*args, **kwargs)
+
+    async def authorize_guest(self, mac: str, minutes: int) -> None:
+        """Authorize a guest without blocking the event loop.
+
+        Args:
+            mac (str): The MAC address of the guest.
+            minutes (int): The duration of the authorization (in minutes).
+        """
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.call, "authorize_guest", mac, minutes
+        )